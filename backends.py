@@ -0,0 +1,147 @@
+"""Runtimes able to serve the turbidity model.
+
+Every backend exposes ``predict(batch)`` taking a float32 array of shape
+(n, 150, 150, 3) as produced by preprocess.preprocess_batch and returning
+an (n, 3) array of (high, low, medium) scores.
+"""
+import threading
+
+import numpy as np
+
+import settings
+
+
+class KerasBackend:
+    name = 'keras'
+    default_path = 'model.h5'
+
+    def __init__(self, path):
+        from tensorflow.keras.models import load_model
+        self.model = load_model(path)
+
+    def predict(self, batch):
+        return np.asarray(self.model.predict_on_batch(batch))
+
+
+class TFLiteBackend:
+    name = 'tflite'
+    default_path = 'model.tflite'
+
+    def __init__(self, path):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:
+                import tensorflow as tf
+                Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=path,
+                                       num_threads=settings.MODEL_THREADS)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self._batch_size = self.input['shape'][0]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _quantization(details):
+        """(scale, zero point) of an integer tensor, None for float tensors"""
+        if np.issubdtype(details['dtype'], np.integer):
+            return details['quantization']
+        return None
+
+    def predict(self, batch):
+        with self._lock:
+            if len(batch) != self._batch_size:
+                self.interpreter.resize_tensor_input(self.input['index'],
+                                                     batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = len(batch)
+            quant = self._quantization(self.input)
+            if quant is not None:
+                # fully integer models take quantized inputs
+                info = np.iinfo(self.input['dtype'])
+                batch = np.clip(np.round(batch / quant[0] + quant[1]),
+                                info.min, info.max).astype(self.input['dtype'])
+            self.interpreter.set_tensor(self.input['index'], batch)
+            self.interpreter.invoke()
+            out = self.interpreter.get_tensor(self.output['index'])
+        quant = self._quantization(self.output)
+        if quant is not None:
+            out = (out.astype(np.float32) - quant[1]) * quant[0]
+        return out
+
+
+class OnnxBackend:
+    name = 'onnx'
+    default_path = 'model.onnx'
+
+    def __init__(self, path):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if settings.MODEL_THREADS:
+            options.intra_op_num_threads = settings.MODEL_THREADS
+        self.session = ort.InferenceSession(
+            path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+BACKENDS = {backend.name: backend
+            for backend in (KerasBackend, TFLiteBackend, OnnxBackend)}
+
+
+def load_backend(name=None, path=None):
+    """Instantiate the backend called name (settings.MODEL_BACKEND when not
+    given) from path, defaulting to the backend's usual artifact name"""
+    name = (name or settings.MODEL_BACKEND).lower()
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError('Invalid model backend {!r}, expected one of {}'
+                         .format(name, ', '.join(sorted(BACKENDS))))
+    return backend(path or settings.MODEL_PATH or backend.default_path)
+
+
+class LazyBackend:
+    """Defer loading a backend until the first prediction or warm_up()"""
+
+    def __init__(self, name=None, path=None):
+        self._args = (name, path)
+        self._backend = None
+        self._lock = threading.Lock()
+        self.state = 'unloaded'
+        self.error = None
+
+    def get(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self.state = 'loading'
+                    try:
+                        self._backend = load_backend(*self._args)
+                    except Exception as e:
+                        self.state = 'failed'
+                        self.error = repr(e)
+                        raise
+                    self.state = 'ready'
+        return self._backend
+
+    def predict(self, batch):
+        return self.get().predict(batch)
+
+    def warm_up(self, batch):
+        """Load the backend and run batch through it on a background thread"""
+        def run():
+            try:
+                self.predict(batch)
+            except Exception:
+                pass  # recorded in state / error
+
+        threading.Thread(target=run, name='model-warm-up', daemon=True).start()
+
+    def status(self):
+        return {'state': self.state, 'error': self.error}
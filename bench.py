@@ -0,0 +1,846 @@
+"""Micro benchmarks for the turbidity and solar endpoints.
+
+Run ``python bench.py <name>``; see ``python bench.py -h`` for the list.
+"""
+import argparse
+import asyncio
+import glob
+import hashlib
+import http.server
+import json
+import subprocess
+import sys
+import threading
+import time
+
+
+def _sample_image_bytes():
+    path = sorted(glob.glob('data/Val/*/*.jpg'))[0]
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class _StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    body = b''
+    etag = ''
+    delay = 0.0
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.send_header('ETag', self.etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def stub_server(body, delay=0.0):
+    """Start a local threaded HTTP server that serves body for every GET"""
+    etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+    handler = type('Handler', (_StubHandler, ), {'body': body, 'etag': etag,
+                                                 'delay': delay})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}/image.jpg'.format(
+        server.server_address[1])
+
+
+def bench_fetch(args):
+    import fetch
+
+    server, url = stub_server(_sample_image_bytes(), args.delay)
+
+    async def run():
+        start = time.perf_counter()
+        sem = asyncio.Semaphore(args.concurrency)
+
+        async def one():
+            async with sem:
+                await fetch.fetch_image(url)
+
+        await asyncio.gather(*[one() for _ in range(args.requests)])
+        elapsed = time.perf_counter() - start
+        await fetch.close_client()
+        return elapsed
+
+    try:
+        elapsed = asyncio.run(run())
+    finally:
+        server.shutdown()
+    print('fetch: {} images, concurrency {}: {:.2f}s, {:.1f} images/s'.format(
+        args.requests, args.concurrency, elapsed, args.requests / elapsed))
+
+
+def bench_batching(args):
+    import numpy as np
+    from tensorflow.keras.models import load_model
+
+    import inference
+
+    model = load_model(args.model)
+    inputs = np.random.rand(args.requests, 1, 150, 150, 3).astype('float32')
+    model.predict(inputs[0])  # warm up
+
+    start = time.perf_counter()
+    for x in inputs:
+        model.predict(x)
+    single = args.requests / (time.perf_counter() - start)
+
+    batcher = inference.InferenceBatcher(model.predict, args.max_batch_size,
+                                         args.max_wait_ms)
+    batcher.start()
+
+    async def run():
+        sem = asyncio.Semaphore(args.concurrency)
+
+        async def one(x):
+            async with sem:
+                await batcher.predict(x)
+
+        await asyncio.gather(*[one(x) for x in inputs])
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    batched = args.requests / (time.perf_counter() - start)
+    batcher.stop()
+    print('per-request predict: {:.1f} req/s'.format(single))
+    print('micro-batched (max {}, {} ms): {:.1f} req/s'.format(
+        batcher.max_batch_size, batcher.max_wait * 1000, batched))
+
+
+def bench_backend_probe(args):
+    import resource
+    start = time.perf_counter()
+    import numpy as np
+
+    import backends
+
+    backend = backends.load_backend(args.backend, args.path)
+    startup = time.perf_counter() - start
+    image = np.random.rand(1, 150, 150, 3).astype('float32')
+    backend.predict(image)
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        backend.predict(image)
+    latency = (time.perf_counter() - start) / args.repeat
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'startup': startup, 'latency': latency,
+                      'max_rss_kb': rss}))
+
+
+def bench_backends(args):
+    for name in args.backends:
+        cmd = [sys.executable, __file__, 'backend-probe', '--backend', name,
+               '--repeat', str(args.repeat)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode:
+            err = proc.stderr.strip().splitlines() or ['failed']
+            print('{:>7}: {}'.format(name, err[-1]))
+            continue
+        r = json.loads(proc.stdout.strip().splitlines()[-1])
+        print('{:>7}: startup {:.2f}s, max RSS {:.0f} MB, '
+              '{:.2f} ms/image'.format(name, r['startup'],
+                                       r['max_rss_kb'] / 1024.,
+                                       r['latency'] * 1000))
+
+
+def bench_sites(args):
+    import numpy as np
+    import pandas as pd
+
+    import zenith
+
+    times = pd.date_range('2020-01-01', periods=args.times, freq='1h',
+                          tz='UTC')
+    rng = np.random.RandomState(0)
+    lats = rng.uniform(-60, 60, args.sites)
+    lons = rng.uniform(-180, 180, args.sites)
+    zenith.spa_python(times[:2], 0, 0)  # import spa outside the timings
+
+    start = time.perf_counter()
+    for lat, lon in zip(lats, lons):
+        zenith.get_solarposition(times, lat, lon)
+    loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    zenith.spa_python_sites(times, lats, lons)
+    batch = time.perf_counter() - start
+    print('{} sites x {} times: per-site loop {:.3f}s, batch {:.3f}s '
+          '({:.1f}x)'.format(args.sites, args.times, loop, batch,
+                             loop / batch))
+
+
+def _reload_spa(how):
+    """What zenith._spa_python_import used to do on every method switch"""
+    import importlib
+    import os
+
+    from pvlib import spa
+    if spa.USE_NUMBA != (how == 'numba'):
+        os.environ['PVLIB_USE_NUMBA'] = '1' if how == 'numba' else '0'
+        spa = importlib.reload(spa)
+        del os.environ['PVLIB_USE_NUMBA']
+    return spa
+
+
+def bench_spa_switch(args):
+    import warnings
+
+    import pandas as pd
+
+    import zenith
+
+    times = pd.date_range('2020-01-01', periods=args.times, freq='1min',
+                          tz='UTC')
+    unixtime = times.asi8 / 1e9
+    methods = ['numpy', 'numba'] * (args.switches // 2)
+
+    def run(load):
+        start = time.perf_counter()
+        for how in methods:
+            spa = load(how)
+            spa.solar_position(unixtime, 40., -105., 1600., 830., 12., 67.,
+                               0.5667, 1)
+        return time.perf_counter() - start
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        reload_time = run(_reload_spa)
+    run(zenith._spa_python_import)  # load both variants once
+    cached_time = run(zenith._spa_python_import)
+    print('{} alternating calls on {} times: reload {:.3f}s, '
+          'cached modules {:.3f}s'.format(len(methods), args.times,
+                                          reload_time, cached_time))
+
+
+def bench_numba_scaling(args):
+    import numpy as np
+
+    import zenith
+
+    zenith.warm_up('numba')
+    spa = zenith._spa_python_import('numba')
+    print('{:>10} {}'.format('timestamps', ' '.join(
+        '{:>9}'.format('{} thr'.format(n)) for n in args.threads)))
+    for size in args.sizes:
+        unixtime = 1.5e9 + np.arange(int(size), dtype=np.float64) * 60
+        row = []
+        for numthreads in args.threads:
+            start = time.perf_counter()
+            zenith._solar_position_numba(spa, unixtime, 40., -105., 1600.,
+                                         830., 12., 67., 0.5667, numthreads)
+            row.append(time.perf_counter() - start)
+        print('{:>10.0e} {}'.format(size, ' '.join(
+            '{:>8.3f}s'.format(t) for t in row)))
+
+
+def bench_table(args):
+    import os
+
+    import pandas as pd
+
+    import zenith
+
+    times = pd.date_range('2020-06-01', periods=args.times, freq='1min',
+                          tz='UTC')
+    if not os.path.exists(args.table):
+        print('building {} for {}...'.format(args.table, times[0].year))
+        zenith.build_ephemeris_table(args.table, times[0].year,
+                                     times[-1].year)
+    zenith.spa_table(times[:2], 40., -105., table=args.table)
+
+    start = time.perf_counter()
+    ref = zenith.spa_python(times, 40., -105.)
+    spa = time.perf_counter() - start
+    start = time.perf_counter()
+    res = zenith.spa_table(times, 40., -105., table=args.table)
+    table = time.perf_counter() - start
+    err = (ref - res).abs().max().max()
+    print('{} times: spa_python {:.3f}s, table {:.3f}s ({:.1f}x), '
+          'max abs difference {:.1e}'.format(args.times, spa, table,
+                                             spa / table, err))
+
+
+def bench_rise_set(args):
+    import numpy as np
+    import pandas as pd
+
+    import zenith
+
+    days = pd.date_range('2020-01-01', periods=args.days, freq='D',
+                         tz='America/Denver')
+    rng = np.random.RandomState(0)
+    lats = rng.uniform(-60, 60, args.sites)
+    lons = rng.uniform(-180, 180, args.sites)
+    zenith.sun_rise_set_transit_arrays(days[:2], 0, 0)
+
+    start = time.perf_counter()
+    for lat, lon in zip(lats, lons):
+        zenith.sun_rise_set_transit_ephem(days, lat, lon)
+    ephem = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for lat, lon in zip(lats, lons):
+        zenith.sun_rise_set_transit_spa(days, lat, lon)
+    spa = time.perf_counter() - start
+
+    start = time.perf_counter()
+    zenith.sun_rise_set_transit_arrays(days, lats, lons)
+    arrays = time.perf_counter() - start
+    print('{} sites x {} days: ephem loop {:.3f}s, per-site spa {:.3f}s, '
+          'arrays {:.3f}s ({:.0f}x over ephem)'.format(
+              args.sites, args.days, ephem, spa, arrays, ephem / arrays))
+
+
+def _series_ephemeris(time, latitude, longitude, pressure=101325,
+                      temperature=12):
+    """zenith.ephemeris before the array kernels: pandas Series refraction
+    masks and a whole-array Kepler loop"""
+    import numpy as np
+    import pandas as pd
+
+    Latitude = latitude
+    Longitude = -1 * longitude
+
+    Abber = 20 / 3600.
+    LatR = np.radians(Latitude)
+
+    # the SPA algorithm needs time to be expressed in terms of
+    # decimal UTC hours of the day of the year.
+
+    # if localized, convert to UTC. otherwise, assume UTC.
+    try:
+        time_utc = time.tz_convert('UTC')
+    except TypeError:
+        time_utc = time
+
+    # strip out the day of the year and calculate the decimal hour
+    DayOfYear = time_utc.dayofyear
+    DecHours = (time_utc.hour + time_utc.minute/60. + time_utc.second/3600. +
+                time_utc.microsecond/3600.e6)
+
+    # np.array needed for pandas > 0.20
+    UnivDate = np.array(DayOfYear)
+    UnivHr = np.array(DecHours)
+
+    Yr = np.array(time_utc.year) - 1900
+    YrBegin = 365 * Yr + np.floor((Yr - 1) / 4.) - 0.5
+
+    Ezero = YrBegin + UnivDate
+    T = Ezero / 36525.
+
+    # Calculate Greenwich Mean Sidereal Time (GMST)
+    GMST0 = 6 / 24. + 38 / 1440. + (
+        45.836 + 8640184.542 * T + 0.0929 * T ** 2) / 86400.
+    GMST0 = 360 * (GMST0 - np.floor(GMST0))
+    GMSTi = np.mod(GMST0 + 360 * (1.0027379093 * UnivHr / 24.), 360)
+
+    # Local apparent sidereal time
+    LocAST = np.mod((360 + GMSTi - Longitude), 360)
+
+    EpochDate = Ezero + UnivHr / 24.
+    T1 = EpochDate / 36525.
+
+    ObliquityR = np.radians(
+        23.452294 - 0.0130125 * T1 - 1.64e-06 * T1 ** 2 + 5.03e-07 * T1 ** 3)
+    MlPerigee = 281.22083 + 4.70684e-05 * EpochDate + 0.000453 * T1 ** 2 + (
+        3e-06 * T1 ** 3)
+    MeanAnom = np.mod((358.47583 + 0.985600267 * EpochDate - 0.00015 *
+                       T1 ** 2 - 3e-06 * T1 ** 3), 360)
+    Eccen = 0.01675104 - 4.18e-05 * T1 - 1.26e-07 * T1 ** 2
+    EccenAnom = MeanAnom
+    E = 0
+
+    while np.max(abs(EccenAnom - E)) > 0.0001:
+        E = EccenAnom
+        EccenAnom = MeanAnom + np.degrees(Eccen)*np.sin(np.radians(E))
+
+    TrueAnom = (
+        2 * np.mod(np.degrees(np.arctan2(
+            ((1 + Eccen) / (1 - Eccen)) ** 0.5 *
+            np.tan(np.radians(EccenAnom) / 2.), 1)), 360))
+    EcLon = np.mod(MlPerigee + TrueAnom, 360) - Abber
+    EcLonR = np.radians(EcLon)
+    DecR = np.arcsin(np.sin(ObliquityR)*np.sin(EcLonR))
+
+    RtAscen = np.degrees(np.arctan2(np.cos(ObliquityR)*np.sin(EcLonR),
+                                    np.cos(EcLonR)))
+
+    HrAngle = LocAST - RtAscen
+    HrAngleR = np.radians(HrAngle)
+    HrAngle = HrAngle - (360 * ((abs(HrAngle) > 180)))
+
+    SunAz = np.degrees(np.arctan2(-np.sin(HrAngleR),
+                                  np.cos(LatR)*np.tan(DecR) -
+                                  np.sin(LatR)*np.cos(HrAngleR)))
+    SunAz[SunAz < 0] += 360
+
+    SunEl = np.degrees(np.arcsin(
+        np.cos(LatR) * np.cos(DecR) * np.cos(HrAngleR) +
+        np.sin(LatR) * np.sin(DecR)))
+
+    SolarTime = (180 + HrAngle) / 15.
+
+    # Calculate refraction correction
+    Elevation = SunEl
+    TanEl = pd.Series(np.tan(np.radians(Elevation)), index=time_utc)
+    Refract = pd.Series(0., index=time_utc)
+
+    Refract[(Elevation > 5) & (Elevation <= 85)] = (
+        58.1/TanEl - 0.07/(TanEl**3) + 8.6e-05/(TanEl**5))
+
+    Refract[(Elevation > -0.575) & (Elevation <= 5)] = (
+        Elevation *
+        (-518.2 + Elevation*(103.4 + Elevation*(-12.79 + Elevation*0.711))) +
+        1735)
+
+    Refract[(Elevation > -1) & (Elevation <= -0.575)] = -20.774 / TanEl
+
+    Refract *= (283/(273. + temperature)) * (pressure/101325.) / 3600.
+
+    ApparentSunEl = SunEl + Refract
+
+    # make output DataFrame
+    DFOut = pd.DataFrame(index=time_utc)
+    DFOut['apparent_elevation'] = ApparentSunEl
+    DFOut['elevation'] = SunEl
+    DFOut['azimuth'] = SunAz
+    DFOut['apparent_zenith'] = 90 - ApparentSunEl
+    DFOut['zenith'] = 90 - SunEl
+    DFOut['solar_time'] = SolarTime
+    DFOut.index = time
+
+    return DFOut
+
+
+def bench_ephemeris(args):
+    import pandas as pd
+
+    import zenith
+
+    times = pd.date_range('2020-01-01', periods=args.times, freq='1min',
+                          tz='UTC')
+    zenith.ephemeris(times[:2], 0, 0, how='numba')  # compile or load cache
+    runs = [('series', lambda: _series_ephemeris(times, 40., -105.))]
+    runs += [(how, lambda how=how: zenith.ephemeris(
+        times, 40., -105., how=how, numthreads=args.threads))
+        for how in ('numpy', 'numba')]
+    for name, run in runs:
+        start = time.perf_counter()
+        run()
+        print('{:>6}: {} times {:.3f}s'.format(
+            name, args.times, time.perf_counter() - start))
+
+
+def _two_pass_pyephem(time, latitude, longitude, altitude=0, pressure=101325,
+                      temperature=12, horizon='+0:00'):
+    """zenith.pyephem before the single pass: two Python loops over time
+    appending to lists"""
+    import numpy as np
+    import pandas as pd
+
+    from zenith import _ephem_setup
+
+    try:
+        import ephem
+    except ImportError:
+        raise ImportError('PyEphem must be installed')
+
+    # if localized, convert to UTC. otherwise, assume UTC.
+    try:
+        time_utc = time.tz_convert('UTC')
+    except TypeError:
+        time_utc = time
+
+    sun_coords = pd.DataFrame(index=time)
+
+    obs, sun = _ephem_setup(latitude, longitude, altitude,
+                            pressure, temperature, horizon)
+
+    # make and fill lists of the sun's altitude and azimuth
+    # this is the pressure and temperature corrected apparent alt/az.
+    alts = []
+    azis = []
+    for thetime in time_utc:
+        obs.date = ephem.Date(thetime)
+        sun.compute(obs)
+        alts.append(sun.alt)
+        azis.append(sun.az)
+
+    sun_coords['apparent_elevation'] = alts
+    sun_coords['apparent_azimuth'] = azis
+
+    # redo it for p=0 to get no atmosphere alt/az
+    obs.pressure = 0
+    alts = []
+    azis = []
+    for thetime in time_utc:
+        obs.date = ephem.Date(thetime)
+        sun.compute(obs)
+        alts.append(sun.alt)
+        azis.append(sun.az)
+
+    sun_coords['elevation'] = alts
+    sun_coords['azimuth'] = azis
+
+    # convert to degrees. add zenith
+    sun_coords = np.rad2deg(sun_coords)
+    sun_coords['apparent_zenith'] = 90 - sun_coords['apparent_elevation']
+    sun_coords['zenith'] = 90 - sun_coords['elevation']
+
+    return sun_coords
+
+
+def bench_pyephem(args):
+    import pandas as pd
+
+    import zenith
+
+    times = pd.date_range('2020-01-01', periods=args.times, freq='1min',
+                          tz='UTC')
+    runs = [('two-pass', lambda: _two_pass_pyephem(times, 40., -105.)),
+            ('single', lambda: zenith.pyephem(times, 40., -105.))]
+    if args.processes > 1:
+        # start the workers outside the timing
+        zenith.pyephem(times[:2 * zenith.PYEPHEM_MIN_CHUNK], 40., -105.,
+                       processes=args.processes)
+        runs.append(('pool', lambda: zenith.pyephem(
+            times, 40., -105., processes=args.processes)))
+    for name, run in runs:
+        start = time.perf_counter()
+        run()
+        print('{:>8}: {} times {:.3f}s'.format(
+            name, args.times, time.perf_counter() - start))
+
+
+def bench_crossings(args):
+    import numpy as np
+    import pandas as pd
+
+    import zenith
+
+    days = pd.date_range('2020-01-01', periods=args.days, freq='D',
+                         tz='UTC')
+    rng = np.random.RandomState(0)
+    lats = rng.uniform(-60, 60, args.sites)
+    lons = rng.uniform(-180, 180, args.sites)
+    transit = zenith.sun_rise_set_transit_arrays(days, lats, lons)['transit']
+
+    start = time.perf_counter()
+    for lat, lon, site_transits in zip(lats, lons, transit):
+        for noon in pd.DatetimeIndex(site_transits).round('us').tz_localize(
+                'UTC'):
+            for lower, upper in ((noon - pd.Timedelta('12h'), noon),
+                                 (noon, noon + pd.Timedelta('12h'))):
+                try:
+                    zenith.calc_time(lower.to_pydatetime(),
+                                     upper.to_pydatetime(), lat, lon, 'alt',
+                                     np.radians(args.value), xtol=1e-5)
+                except ValueError:
+                    pass  # no crossing that half day
+    loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    zenith.elevation_crossings(days, lats, lons, args.value)
+    arrays = time.perf_counter() - start
+    print('{} sites x {} days: calc_time loop {:.3f}s, elevation_crossings '
+          '{:.3f}s ({:.0f}x)'.format(args.sites, args.days, loop, arrays,
+                                     loop / arrays))
+
+
+def bench_formats(args):
+    import numpy as np
+    from fastapi.responses import JSONResponse
+
+    import formats
+
+    rng = np.random.RandomState(0)
+    columns = {'time': np.arange(args.rows, dtype=np.int64)}
+    columns.update(('c{}'.format(i), rng.uniform(0, 360, args.rows))
+                   for i in range(6))
+
+    start = time.perf_counter()
+    body = JSONResponse({name: values.tolist()
+                         for name, values in columns.items()}).body
+    print('{:>28}: {:.3f}s {:>10} bytes'.format(
+        'json', time.perf_counter() - start, len(body)))
+    for media_type in formats.MEDIA_TYPES:
+        start = time.perf_counter()
+        body = formats.response(media_type, columns).body
+        print('{:>28}: {:.3f}s {:>10} bytes'.format(
+            media_type.split('/')[1], time.perf_counter() - start,
+            len(body)))
+
+
+def bench_solar_cache(args):
+    import pandas as pd
+
+    import zenith
+
+    cache = zenith.SolarPositionCache()
+    start_time = pd.Timestamp('2024-06-01 18:00', tz='UTC')
+    # sites polling every 100 ms, as the /sun clients do
+    polls = [(start_time + pd.Timedelta(milliseconds=100 * i), 40., -105.)
+             for i in range(args.polls)]
+    zenith.get_solarposition(start_time, 40., -105.)
+
+    start = time.perf_counter()
+    for poll in polls:
+        zenith.get_solarposition(*poll)
+    direct = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for poll in polls:
+        cache.get_solarposition(*poll)
+    cached = time.perf_counter() - start
+    print('{} polls: direct {:.3f}s, cached {:.3f}s ({:.1f}x) {}'.format(
+        args.polls, direct, cached, direct / cached, cache.stats()))
+
+
+def bench_analytical(args):
+    import pandas as pd
+
+    import zenith
+
+    times = pd.date_range('2023-01-01', periods=args.times, freq='1min',
+                          tz='UTC')
+    zenith.get_solarposition(times[:2], 40., -105., method='analytical')
+    timings = {}
+    results = {}
+    for method in ('nrel_numpy', 'analytical'):
+        start = time.perf_counter()
+        results[method] = zenith.get_solarposition(times, 40., -105.,
+                                                   method=method)
+        timings[method] = time.perf_counter() - start
+    err = (results['analytical']['zenith'] -
+           results['nrel_numpy']['zenith']).abs().max()
+    print('{} times: nrel_numpy {:.3f}s, analytical {:.3f}s ({:.1f}x), '
+          'max zenith difference {:.3f} deg'.format(
+              args.times, timings['nrel_numpy'], timings['analytical'],
+              timings['nrel_numpy'] / timings['analytical'], err))
+
+
+def bench_sun_latency(args):
+    import numpy as np
+    import pandas as pd
+
+    import zenith
+
+    timestamp = pd.Timestamp('2024-06-01 18:00', tz='UTC').value
+    zenith.warm_up('numba')
+    zenith.get_solarposition(timestamp, 40., -105.)
+
+    def p50(call, calls):
+        timings = np.empty(calls)
+        for i in range(calls):
+            start = time.perf_counter()
+            call()
+            timings[i] = time.perf_counter() - start
+        return np.median(timings) * 1e6
+
+    frame = p50(lambda: zenith.get_solarposition(timestamp, 40., -105.),
+                args.calls)
+    arrays = {how: p50(lambda: zenith.solar_position_arrays(
+        timestamp / 1e9, 40., -105., how=how, numthreads=1), args.calls)
+        for how in ('numpy', 'numba')}
+    print('single timestamp p50: get_solarposition {:.1f}us, '
+          'solar_position_arrays numpy {:.1f}us, numba {:.1f}us'.format(
+              frame, arrays['numpy'], arrays['numba']))
+
+
+def bench_spa_c(args):
+    import os
+
+    import pandas as pd
+
+    import zenith
+
+    try:
+        zenith._spa_calc()
+    except ImportError as e:
+        print('nrel_c unavailable: {}'.format(e))
+        return
+    processes = args.processes or os.cpu_count() or 1
+    zenith.warm_up('numba')
+    for n in args.times:
+        times = pd.date_range('2023-01-01', periods=n, freq='10s', tz='UTC')
+        runs = [('nrel_numpy', {}),
+                ('nrel_numba', {'numthreads': processes}),
+                ('nrel_c', {'processes': 1}),
+                ('nrel_c', {'processes': processes})]
+        line = []
+        for method, kwargs in runs:
+            start = time.perf_counter()
+            zenith.get_solarposition(times, 40., -105., method=method,
+                                     **kwargs)
+            line.append('{} {} {:.2f}s'.format(
+                method, ','.join('{}={}'.format(*kv) for kv in kwargs.items()),
+                time.perf_counter() - start))
+        print('{} times: {}'.format(n, ', '.join(line)))
+
+
+def bench_earthsun(args):
+    import resource
+
+    import numpy as np
+    import pandas as pd
+
+    import zenith
+
+    times = pd.date_range('2023-01-01', periods=args.times, freq='1min',
+                          tz='UTC')
+    start = time.perf_counter()
+    direct = zenith.nrel_earthsun_distance(times)
+    direct_time = time.perf_counter() - start
+    start = time.perf_counter()
+    table = zenith.EarthSunDistanceTable().distance(
+        times.values.astype('datetime64[ns]').astype(np.int64) / 1e9)
+    table_time = time.perf_counter() - start
+    print('{} times: nrel_earthsun_distance {:.3f}s, daily table {:.3f}s '
+          '({:.0f}x), max difference {:.1e} AU'.format(
+              args.times, direct_time, table_time, direct_time / table_time,
+              np.abs(table - direct.values).max()))
+
+    rows = 0
+    start = time.perf_counter()
+    for chunk in zenith.earthsun_chunks(
+            '{}-01-01'.format(2024 - args.years), '2023-12-31 23:59',
+            freq='1min', tz='UTC'):
+        rows += len(chunk)
+    print('{} years at 1min: {} rows streamed in {:.2f}s, peak RSS {:.0f} MB'
+          .format(args.years, rows, time.perf_counter() - start,
+                  resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    p = sub.add_parser('fetch', help='concurrent image fetch + decode')
+    p.add_argument('--requests', type=int, default=500)
+    p.add_argument('--concurrency', type=int, default=50)
+    p.add_argument('--delay', type=float, default=0.05,
+                   help='seconds the stub server waits before replying')
+    p.set_defaults(func=bench_fetch)
+
+    p = sub.add_parser('batching', help='per-request vs batched predict')
+    p.add_argument('--model', default='model.h5')
+    p.add_argument('--requests', type=int, default=256)
+    p.add_argument('--concurrency', type=int, default=64)
+    p.add_argument('--max-batch-size', type=int, default=None)
+    p.add_argument('--max-wait-ms', type=float, default=None)
+    p.set_defaults(func=bench_batching)
+
+    p = sub.add_parser('backends',
+                       help='startup, memory and latency per model runtime')
+    p.add_argument('--backends', nargs='+',
+                   default=['keras', 'tflite', 'onnx'])
+    p.add_argument('--repeat', type=int, default=200)
+    p.set_defaults(func=bench_backends)
+
+    p = sub.add_parser('backend-probe')
+    p.add_argument('--backend', required=True)
+    p.add_argument('--path', default=None)
+    p.add_argument('--repeat', type=int, default=200)
+    p.set_defaults(func=bench_backend_probe)
+
+    p = sub.add_parser('sites', help='per-site loop vs spa_python_sites')
+    p.add_argument('--sites', type=int, default=1000)
+    p.add_argument('--times', type=int, default=24)
+    p.set_defaults(func=bench_sites)
+
+    p = sub.add_parser('spa-switch',
+                       help='alternate nrel_numpy / nrel_numba calls')
+    p.add_argument('--switches', type=int, default=20)
+    p.add_argument('--times', type=int, default=1000)
+    p.set_defaults(func=bench_spa_switch)
+
+    p = sub.add_parser('numba-scaling',
+                       help='nrel_numba time vs timestamps and threads')
+    p.add_argument('--sizes', type=float, nargs='+',
+                   default=[1e3, 1e4, 1e5, 1e6, 1e7])
+    p.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    p.set_defaults(func=bench_numba_scaling)
+
+    p = sub.add_parser('table', help="spa_python vs method='table'")
+    p.add_argument('--times', type=int, default=100000)
+    p.add_argument('--table', default='ephemeris_table.npy')
+    p.set_defaults(func=bench_table)
+
+    p = sub.add_parser('rise-set',
+                       help='ephem loop vs sun_rise_set_transit_arrays')
+    p.add_argument('--days', type=int, default=365)
+    p.add_argument('--sites', type=int, default=10)
+    p.set_defaults(func=bench_rise_set)
+
+    p = sub.add_parser('ephemeris',
+                       help="series vs array method='ephemeris' kernels")
+    p.add_argument('--times', type=int, default=1000000)
+    p.add_argument('--threads', type=int, default=4)
+    p.set_defaults(func=bench_ephemeris)
+
+    p = sub.add_parser('pyephem', help="two-pass vs single pass pyephem")
+    p.add_argument('--times', type=int, default=200000)
+    p.add_argument('--processes', type=int, default=1)
+    p.set_defaults(func=bench_pyephem)
+
+    p = sub.add_parser('crossings',
+                       help='calc_time loop vs elevation_crossings')
+    p.add_argument('--days', type=int, default=365)
+    p.add_argument('--sites', type=int, default=4)
+    p.add_argument('--value', type=float, default=10.)
+    p.set_defaults(func=bench_crossings)
+
+    p = sub.add_parser('formats', help='JSON vs binary solar responses')
+    p.add_argument('--rows', type=int, default=1000000)
+    p.set_defaults(func=bench_formats)
+
+    p = sub.add_parser('solar-cache',
+                       help='repeated /sun polls with and without the cache')
+    p.add_argument('--polls', type=int, default=1000)
+    p.set_defaults(func=bench_solar_cache)
+
+    p = sub.add_parser('analytical',
+                       help="nrel_numpy vs method='analytical'")
+    p.add_argument('--times', type=int, default=1000000)
+    p.set_defaults(func=bench_analytical)
+
+    p = sub.add_parser('sun-latency',
+                       help='single timestamp DataFrame vs array-native SPA')
+    p.add_argument('--calls', type=int, default=2000)
+    p.set_defaults(func=bench_sun_latency)
+
+    p = sub.add_parser('spa-c',
+                       help='chunked nrel_c vs nrel_numpy and nrel_numba')
+    p.add_argument('--times', type=int, nargs='+',
+                   default=[10**5, 10**6, 10**7])
+    p.add_argument('--processes', type=int, default=None,
+                   help='defaults to the CPU count')
+    p.set_defaults(func=bench_spa_c)
+
+    p = sub.add_parser('earthsun',
+                       help='per timestamp vs daily earth-sun distance')
+    p.add_argument('--times', type=int, default=1000000)
+    p.add_argument('--years', type=int, default=30)
+    p.set_defaults(func=bench_earthsun)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""LRU/TTL cache of turbidity predictions keyed by image content."""
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import settings
+
+# rough per-entry bookkeeping cost (dict slot, tuple, key string) in bytes
+_ENTRY_OVERHEAD = 200
+# the sqlite tier is pruned to max_entries rows every this many puts
+_PRUNE_EVERY = 1000
+
+
+def image_key(image):
+    """Content hash of a decoded image array"""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(str(image.shape).encode())
+    h.update(np.ascontiguousarray(image).data)
+    return h.hexdigest()
+
+
+class PredictionCache:
+    """Bounded in-memory LRU of prediction scores with an optional sqlite
+    tier on disk so results survive restarts.
+
+    Entries expire ttl seconds after they were stored (0 disables expiry).
+    Besides content keys the cache remembers the last ETag and content key
+    seen for each url so a conditional request can skip download and
+    inference altogether.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None,
+                 disk_path=None):
+        self.max_entries = max_entries or settings.CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or settings.CACHE_MAX_BYTES
+        self.ttl = settings.CACHE_TTL if ttl is None else ttl
+        if disk_path is None:
+            disk_path = settings.CACHE_DISK_PATH
+        self._entries = OrderedDict()
+        self._urls = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._miss_seconds = 0.
+        self._puts = 0
+        self._db = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS predictions '
+                             '(key TEXT PRIMARY KEY, scores BLOB, '
+                             'stored REAL)')
+            self._db.commit()
+
+    def _expired(self, stored):
+        return self.ttl > 0 and time.time() - stored > self.ttl
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or
+                                 self._bytes > self.max_bytes):
+            key, (scores, _) = self._entries.popitem(last=False)
+            self._bytes -= len(key) + scores.nbytes + _ENTRY_OVERHEAD
+        while len(self._urls) > self.max_entries:
+            self._urls.popitem(last=False)
+
+    def _store(self, key, scores, stored):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        else:
+            self._bytes += len(key) + scores.nbytes + _ENTRY_OVERHEAD
+        self._entries[key] = (scores, stored)
+        self._evict()
+
+    def _disk_get(self, key):
+        if self._db is None:
+            return None
+        row = self._db.execute('SELECT scores, stored FROM predictions '
+                               'WHERE key = ?', (key, )).fetchone()
+        if row is None or self._expired(row[1]):
+            return None
+        scores = np.frombuffer(row[0], dtype=np.float32).copy()
+        self._store(key, scores, row[1])
+        self.disk_hits += 1
+        return scores
+
+    def _disk_prune(self):
+        # drop expired rows, then keep the newest max_entries
+        if self.ttl > 0:
+            self._db.execute('DELETE FROM predictions WHERE stored < ?',
+                             (time.time() - self.ttl, ))
+        self._db.execute('DELETE FROM predictions WHERE key NOT IN '
+                         '(SELECT key FROM predictions ORDER BY '
+                         'stored DESC LIMIT ?)', (self.max_entries, ))
+
+    @property
+    def on_disk(self):
+        """Whether get and put may block on the sqlite tier"""
+        return self._db is not None
+
+    def get(self, key, count_miss=True):
+        """Cached scores for key, or None; counts a hit, and a miss unless
+        count_miss is False"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[1]):
+                self._bytes -= len(key) + entry[0].nbytes + _ENTRY_OVERHEAD
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                scores = entry[0]
+            else:
+                scores = self._disk_get(key)
+            if scores is None:
+                if count_miss:
+                    self.misses += 1
+            else:
+                self.hits += 1
+            return scores
+
+    def put(self, key, scores):
+        self.put_many([(key, scores)])
+
+    def put_many(self, items):
+        """Store (key, scores) pairs, with one sqlite commit"""
+        stored = time.time()
+        items = [(key, np.asarray(scores, dtype=np.float32))
+                 for key, scores in items]
+        with self._lock:
+            for key, scores in items:
+                self._store(key, scores, stored)
+            if self._db is not None:
+                self._db.executemany('INSERT OR REPLACE INTO predictions '
+                                     'VALUES (?, ?, ?)',
+                                     [(key, scores.tobytes(), stored)
+                                      for key, scores in items])
+                puts = self._puts + len(items)
+                if puts // _PRUNE_EVERY > self._puts // _PRUNE_EVERY:
+                    self._disk_prune()
+                self._puts = puts
+                self._db.commit()
+
+    def get_url(self, url):
+        """(etag, content key) last seen for url, or None"""
+        with self._lock:
+            known = self._urls.get(url)
+            if known is not None:
+                self._urls.move_to_end(url)
+            return known
+
+    def put_url(self, url, etag, key):
+        with self._lock:
+            self._urls[url] = (etag, key)
+            self._urls.move_to_end(url)
+            self._evict()
+
+    def record_miss_latency(self, seconds, images=1):
+        """Account seconds spent computing each of images results that were
+        not cached"""
+        with self._lock:
+            self._miss_seconds += seconds * images
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            computed = max(self.misses, 1)
+            avg_miss = self._miss_seconds / computed
+            return {'entries': len(self._entries),
+                    'bytes': self._bytes,
+                    'urls': len(self._urls),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'disk_hits': self.disk_hits,
+                    'hit_rate': self.hits / lookups if lookups else 0.,
+                    'avg_miss_seconds': avg_miss,
+                    'seconds_saved': self.hits * avg_miss}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,105 @@
+"""Convert the Keras turbidity model to lightweight runtimes.
+
+    python export.py --tflite model.tflite --onnx model.onnx
+
+After exporting, every artifact is run over the validation images and
+compared against the Keras model; the script exits non-zero if the scores
+differ by more than --atol or any predicted class changes.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import cv2
+
+import backends
+import preprocess
+import train_turbidity
+
+INPUT_SHAPE = (None, preprocess.IMAGE_SIZE[1], preprocess.IMAGE_SIZE[0], 3)
+
+
+def load_images(directory, limit=None):
+    """Preprocessed images and class indices from a directory laid out like
+    data/Val (one sub directory per class, sorted as flow_from_directory
+    does so that indices line up with the model's outputs)"""
+    paths, labels, _ = train_turbidity.list_images(directory)
+    if limit:
+        order = np.random.RandomState(0).permutation(len(paths))[:limit]
+        paths = [paths[i] for i in order]
+        labels = [labels[i] for i in order]
+    images = [cv2.imread(p) for p in paths]
+    return preprocess.preprocess_batch(images), np.array(labels)
+
+
+def export_tflite(model, path):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    with open(path, 'wb') as f:
+        f.write(converter.convert())
+
+
+def export_onnx(model, path):
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = (tf.TensorSpec(INPUT_SHAPE, tf.float32, name='input'), )
+    # tracing through a tf.function works for both tf.keras 2 and Keras 3
+    # models, unlike tf2onnx.convert.from_keras
+    forward = tf.function(lambda x: model(x, training=False))
+    tf2onnx.convert.from_function(forward, input_signature=spec, opset=13,
+                                  output_path=path)
+
+
+def check_parity(reference, candidate, images, batch_size=32, atol=1e-4):
+    """Max abs score difference and number of changed predictions"""
+    max_diff = 0.
+    changed = 0
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        ref = reference.predict(batch)
+        out = candidate.predict(batch)
+        max_diff = max(max_diff, float(np.max(np.abs(ref - out))))
+        changed += int(np.sum(ref.argmax(axis=1) != out.argmax(axis=1)))
+    return max_diff, changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='model.h5')
+    parser.add_argument('--tflite', help='write a TFLite model here')
+    parser.add_argument('--onnx', help='write an ONNX model here')
+    parser.add_argument('--val', default=os.path.join('data', 'Val'))
+    parser.add_argument('--atol', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    if not (args.tflite or args.onnx):
+        parser.error('nothing to export, pass --tflite and/or --onnx')
+
+    reference = backends.KerasBackend(args.model)
+    exported = []
+    if args.tflite:
+        export_tflite(reference.model, args.tflite)
+        exported.append(backends.TFLiteBackend(args.tflite))
+    if args.onnx:
+        export_onnx(reference.model, args.onnx)
+        exported.append(backends.OnnxBackend(args.onnx))
+
+    images, _ = load_images(args.val)
+    ok = True
+    for backend in exported:
+        max_diff, changed = check_parity(reference, backend, images)
+        passed = max_diff <= args.atol and changed == 0
+        ok = ok and passed
+        print('{}: max |diff| {:.2e}, {} of {} predictions changed: {}'.format(
+            backend.name, max_diff, changed, len(images),
+            'ok' if passed else 'FAILED'))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
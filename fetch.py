@@ -0,0 +1,85 @@
+import numpy as np
+import cv2
+import httpx
+
+import settings
+
+
+class ImageFetchError(Exception):
+    pass
+
+
+_client = None
+
+
+def get_client():
+    """Return the process wide pooled HTTP client, creating it on first use"""
+    global _client
+    if _client is None or _client.is_closed:
+        timeout = httpx.Timeout(settings.FETCH_READ_TIMEOUT,
+                                connect=settings.FETCH_CONNECT_TIMEOUT)
+        limits = httpx.Limits(
+            max_connections=settings.FETCH_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.FETCH_MAX_KEEPALIVE)
+        _client = httpx.AsyncClient(timeout=timeout, limits=limits,
+                                    follow_redirects=True)
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def fetch_bytes_etag(url, etag=None, max_bytes=None):
+    """Download url into memory, refusing bodies larger than max_bytes.
+
+    When etag is given the request is conditional; a 304 reply returns
+    (None, etag). Otherwise returns (body, ETag header or None).
+    """
+    max_bytes = max_bytes or settings.FETCH_MAX_BYTES
+    client = get_client()
+    headers = {'If-None-Match': etag} if etag else None
+    try:
+        async with client.stream('GET', url, headers=headers) as response:
+            if response.status_code == 304 and etag:
+                return None, etag
+            if response.status_code != 200:
+                raise ImageFetchError(
+                    'Image url returned HTTP {}'.format(response.status_code))
+            length = response.headers.get('content-length')
+            if length is not None and int(length) > max_bytes:
+                raise ImageFetchError('Image larger than {} bytes'.format(
+                    max_bytes))
+            buf = bytearray()
+            async for chunk in response.aiter_bytes():
+                buf += chunk
+                if len(buf) > max_bytes:
+                    raise ImageFetchError('Image larger than {} bytes'.format(
+                        max_bytes))
+            etag = response.headers.get('etag')
+    except httpx.TimeoutException:
+        raise ImageFetchError('Timed out fetching image url')
+    except (httpx.HTTPError, httpx.InvalidURL, ValueError) as e:
+        raise ImageFetchError('Could not fetch image url: {}'.format(e))
+    return bytes(buf), etag
+
+
+async def fetch_bytes(url, max_bytes=None):
+    data, _ = await fetch_bytes_etag(url, max_bytes=max_bytes)
+    return data
+
+
+def decode_image(data):
+    """Decode encoded image bytes to a BGR array without touching disk"""
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8),
+                         cv2.IMREAD_COLOR)
+    if image is None:
+        raise ImageFetchError('Could not decode image')
+    return image
+
+
+async def fetch_image(url):
+    return decode_image(await fetch_bytes(url))
@@ -0,0 +1,90 @@
+"""Binary encodings of solar position columns for content negotiation.
+
+JSON stays the default. Clients that list one of MEDIA_TYPES in their
+Accept header get the result arrays serialized as they are:
+
+- Arrow IPC stream: one flattened column per field (needs pyarrow)
+- NumPy .npy: a float64 array shaped (len(columns),) + column shape
+- raw: the same array as little-endian float64 bytes, C order
+
+Binary responses name their columns, in order, in the X-Columns header
+and give the column shape in X-Shape.
+"""
+import io
+
+import numpy as np
+from fastapi.responses import JSONResponse, Response
+
+ARROW = "application/vnd.apache.arrow.stream"
+NPY = "application/x-npy"
+RAW = "application/octet-stream"
+
+MEDIA_TYPES = (ARROW, NPY, RAW)
+
+# short names accepted in place of an Accept header, e.g. a format field
+FORMATS = {"arrow": ARROW, "npy": NPY, "raw": RAW}
+
+
+class FormatUnavailable(Exception):
+    pass
+
+
+def negotiate(accept=None, format=None):
+    """Binary media type requested by format or the Accept header, or None
+    for JSON"""
+    if format in FORMATS:
+        return FORMATS[format]
+    for media_type in (accept or "").split(","):
+        media_type = media_type.split(";")[0].strip().lower()
+        if media_type in MEDIA_TYPES:
+            return media_type
+    return None
+
+
+def _stacked(columns):
+    arrays = list(columns.values())
+    out = np.empty((len(arrays),) + np.shape(arrays[0]), dtype="<f8")
+    for row, values in zip(out, arrays):
+        row[...] = values
+    return out
+
+
+def _arrow(columns):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise FormatUnavailable("pyarrow must be installed for Arrow output")
+    table = pa.table({name: np.ravel(values)
+                      for name, values in columns.items()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def encode(media_type, columns):
+    """Serialize a dict of equally shaped arrays as media_type"""
+    if media_type == ARROW:
+        return _arrow(columns)
+    out = _stacked(columns)
+    if media_type == RAW:
+        return out.data
+    buf = io.BytesIO()
+    np.lib.format.write_array(buf, out, allow_pickle=False)
+    return buf.getbuffer()
+
+
+def response(media_type, columns):
+    """Response with columns encoded as media_type; a 406 JSON message when
+    the encoding is not available here"""
+    try:
+        body = encode(media_type, columns)
+    except FormatUnavailable as e:
+        return JSONResponse({"message": str(e)}, status_code=406)
+    headers = {"X-Columns": ",".join(columns),
+               "X-Shape": ",".join(
+                   str(n) for n in np.shape(next(iter(columns.values()))))}
+    # a flat byte view so the body is sent without copying and its length
+    # is the byte count
+    return Response(memoryview(body).cast("B"), media_type=media_type,
+                    headers=headers)
@@ -0,0 +1,94 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+import settings
+
+
+class InferenceBatcher:
+    """Coalesce concurrent predictions into one call on a worker thread.
+
+    Each submitted item is an array of one or more input rows. The worker
+    waits for the first item, then keeps collecting until either
+    max_batch_size rows are queued or max_wait_ms has passed, runs a single
+    predict on the concatenated batch and hands every caller back its own
+    rows of the output.
+    """
+
+    def __init__(self, predict, max_batch_size=None, max_wait_ms=None):
+        self.predict_fn = predict
+        self.max_batch_size = max_batch_size or settings.BATCH_MAX_SIZE
+        if max_wait_ms is None:
+            max_wait_ms = settings.BATCH_MAX_WAIT_MS
+        self.max_wait = max_wait_ms / 1000.
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                                            name='inference-batcher',
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, batch):
+        """Queue batch for prediction and return a concurrent Future"""
+        future = Future()
+        self._queue.put((batch, future))
+        return future
+
+    async def predict(self, batch):
+        return await asyncio.wrap_future(self.submit(batch))
+
+    def _collect(self, first):
+        items = [first]
+        rows = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # re-queue the sentinel so the run loop exits after this batch
+                self._queue.put(None)
+                break
+            items.append(item)
+            rows += len(item[0])
+        return items
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            items = self._collect(first)
+            futures = [future for _, future in items]
+            try:
+                if len(items) == 1:
+                    batch = items[0][0]
+                else:
+                    batch = np.concatenate([b for b, _ in items])
+                out = np.asarray(self.predict_fn(batch))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for b, future in items:
+                future.set_result(out[start:start + len(b)])
+                start += len(b)
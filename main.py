@@ -1,12 +1,11 @@
-from fastapi import FastAPI
-from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
-from tensorflow.keras.preprocessing.image import img_to_array
-from tensorflow.keras.models import load_model
-import numpy as np
-import cv2
-import os
+from fastapi import FastAPI, Header
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
+from typing import List, Optional
 import zenith as sunFun
+import formats
+import settings
 import datetime as dt
 try:
     from importlib import reload
@@ -16,71 +15,390 @@ except ImportError:
     except ImportError:
         pass
 
+import numpy as np
 import pandas as pd
 import warnings
 
-from pvlib import atmosphere
-from pvlib.tools import datetime_to_djd, djd_to_datetime
-
-
-class Image(BaseModel):
-    imageurl: str
+if settings.TURBIDITY_ENABLED:
+    import turbidity
+else:
+    turbidity = None
 
 
 class SunClass(BaseModel):
     latitude: float
     longitude: float
     timezone: float
+    method: Optional[str] = None
+
+
+class SunSeries(BaseModel):
+    latitude: float
+    longitude: float
+    start: str
+    end: str
+    freq: str = "1h"
+    timezone: str = "UTC"
+    altitude: float = 0.
+    format: str = "json"
+    method: Optional[str] = None
+
+
+class SunSites(BaseModel):
+    latitudes: List[float]
+    longitudes: List[float]
+    altitudes: Optional[List[float]] = None
+    start: str
+    end: str
+    freq: str = "1h"
+    timezone: str = "UTC"
+
+
+class SunEvents(BaseModel):
+    latitudes: List[float]
+    longitudes: List[float]
+    start: str
+    end: str
+    timezone: str = "UTC"
+
+
+class SunCrossings(SunEvents):
+    value: float
+    attribute: str = "apparent_elevation"
+
+
+SOLAR_COLUMNS = ["apparent_zenith", "zenith", "apparent_elevation",
+                 "elevation", "azimuth", "equation_of_time"]
 
 
 # Create an instance of FastAPI class
 app = FastAPI()
 
-# Load model
-model = load_model('model.h5')
-
-
-@app.post("/")
-async def root(image: Image):
-    if(not image.imageurl):
-        return {"message": "No Image url passed"}
-    os.system("wget -O image.jpg " + image.imageurl)
-    imgpath = 'image.jpg'
-    image = cv2.imread(imgpath)
-    # y, x, s = image.shape
-    # print(image.shape)
-    # cx = x//2
-    # cy = y//2
-    # print(cx,cy)
-    # image_cropped = image[cy-150:cy+150, cx-150:cx+150]
-    orig = image.copy()
-    (h, w) = image.shape[:2]
-
-    img = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    img = cv2.resize(img, (150, 150))
-    img = img_to_array(img)
-    img = preprocess_input(img)
-    img = np.expand_dims(img, axis=0)
-
-    (h, l, m) = model.predict(img)[0]
-    # print(h,l,m)
-    val = max(h, l, m)
-    if val == h:
-        label = "HIGH"
-    elif val == l:
-        label = "LOW"
-    else:
-        label = "MEDIUM"
-    color = (0, 0, 255)
+if turbidity is not None:
+    app.include_router(turbidity.router)
+
+
+if settings.SOLAR_CACHE_ENTRIES > 0:
+    solar_cache = sunFun.SolarPositionCache(
+        settings.SOLAR_CACHE_ENTRIES, settings.SOLAR_CACHE_POSITION_STEP,
+        settings.SOLAR_CACHE_TIME_STEP, settings.SOLAR_CACHE_DISK_PATH)
+else:
+    solar_cache = None
+
+
+# solar position methods a request may ask for: the ones whose
+# dependencies, or table file, are present
+SOLAR_METHODS = tuple(sunFun.available_methods(settings.EPHEMERIS_TABLE))
+
+# raised by a solar engine for inputs or setups it can't handle, e.g. times
+# outside the ephemeris table or a missing SPA C extension
+SOLAR_ERRORS = (ValueError, ImportError, OSError)
+
+
+def solar_kwargs(method=None):
+    """Solar position method and threading options, for the requested
+    method or the SOLAR_METHOD setting"""
+    method = method or settings.SOLAR_METHOD
+    kwargs = {"method": method}
+    if method in ("nrel_numpy", "nrel_numba"):
+        kwargs["numthreads"] = settings.SPA_NUMTHREADS
+    elif method in ("nrel_c", "pyephem"):
+        kwargs["processes"] = settings.SOLAR_PROCESSES
+    elif method == "table":
+        kwargs["table"] = settings.EPHEMERIS_TABLE
+    return kwargs
+
+
+SCALAR_NUMBA = settings.SPA_SCALAR_NUMBA and sunFun.numba_available()
+
+
+def _scalar_how(method):
+    """spa build for the /sun fast path, or None to go through
+    get_solarposition"""
+    if method == "nrel_numba" or (method == "nrel_numpy" and SCALAR_NUMBA):
+        return "numba"
+    return None
+
+
+def _invalid_method(method):
+    """Error message for an unknown requested method, or None"""
+    if method is not None and method not in SOLAR_METHODS:
+        return {"message": "method must be one of {}".format(
+            ", ".join(SOLAR_METHODS))}
+    return None
+
+
+@app.on_event("startup")
+async def startup():
+    if settings.SOLAR_METHOD == "nrel_numba" or SCALAR_NUMBA:
+        # compile, or load from numba's on-disk cache, before serving
+        await run_in_threadpool(sunFun.warm_up, "numba")
+    if turbidity is not None:
+        turbidity.startup()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await run_in_threadpool(sunFun.shutdown_process_pools)
+    if solar_cache is not None:
+        solar_cache.close()
+    if turbidity is not None:
+        await turbidity.shutdown()
+
 
-    # include the probability in the label
-    label = "{}: {:.2f}%".format(label, max(h, l, m) * 100)
-    return {"turbidity": label}
+@app.get("/ready")
+async def ready():
+    status = {"ready": True, "turbidity": {"enabled": turbidity is not None}}
+    if turbidity is not None:
+        model = turbidity.model_status()
+        status["turbidity"].update(model)
+        # a lazily loaded model only holds up readiness when warm-up was
+        # requested or loading failed
+        if model["state"] == "failed" or (settings.MODEL_WARMUP and
+                                          model["state"] != "ready"):
+            status["ready"] = False
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/metrics")
+async def metrics():
+    out = {}
+    if solar_cache is not None:
+        out["solar_cache"] = solar_cache.stats()
+    if turbidity is not None:
+        out["prediction_cache"] = turbidity.prediction_cache.stats()
+    return out
 
 
 @app.post("/sun")
-async def sun(sunclass: SunClass):
-    res = sunFun.get_solarposition(
-        sunclass.timezone, sunclass.latitude, sunclass.longitude)
-    l = res.values.tolist()[0]
-    return {"apparent_zenith": l[0], "zenith": l[1], "apparent_elevation": l[2], "elevation": l[3], "azimuth": l[4], "equation_of_time": l[5]}
+async def sun(sunclass: SunClass, accept: Optional[str] = Header(None)):
+    invalid = _invalid_method(sunclass.method)
+    if invalid:
+        return invalid
+    media_type = formats.negotiate(accept)
+    how = _scalar_how(sunclass.method or settings.SOLAR_METHOD)
+    if how is not None:
+        # straight to the compiled SPA loop: no DatetimeIndex or DataFrame.
+        # Computing is cheaper than a lookup, so solar_cache is bypassed and
+        # these requests don't count in its /metrics stats. get_solarposition
+        # reads the bare number as nanoseconds since the epoch, and so does
+        # this
+        position = sunFun.solar_position_arrays(
+            sunclass.timezone / 1e9, sunclass.latitude, sunclass.longitude,
+            how=how, numthreads=1)._asdict()
+        if media_type is not None:
+            return formats.response(media_type, position)
+        return JSONResponse({column: float(values[0])
+                             for column, values in position.items()})
+    solarposition = sunFun.get_solarposition if solar_cache is None \
+        else solar_cache.get_solarposition
+    args = (sunclass.timezone, sunclass.latitude, sunclass.longitude)
+    try:
+        if solar_cache is not None and solar_cache.on_disk:
+            # sqlite reads, commits and pruning, plus any miss, can wait on
+            # other workers' write lock; keep them off the event loop
+            res = await run_in_threadpool(
+                solarposition, *args, **solar_kwargs(sunclass.method))
+        else:
+            res = solarposition(*args, **solar_kwargs(sunclass.method))
+    except SOLAR_ERRORS as e:
+        return {"message": "Solar position failed: {}".format(e)}
+    columns = _solar_columns(res)
+    if media_type is not None:
+        return formats.response(media_type, columns)
+    # null for columns the engine doesn't compute
+    return {column: float(columns[column][0]) if column in columns else None
+            for column in SOLAR_COLUMNS}
+
+
+def _solar_columns(res):
+    """SOLAR_COLUMNS of a solar position DataFrame, by name. Engines
+    without an equation of time (ephemeris, pyephem, nrel_c) leave it out"""
+    return {column: res[column].values
+            for column in SOLAR_COLUMNS if column in res}
+
+
+def _series_rows(series, freq):
+    """Upper estimate of the timestamps from start to end every freq,
+    without building them"""
+    start = pd.Timestamp(series.start, tz=series.timezone)
+    end = pd.Timestamp(series.end, tz=series.timezone)
+    if end < start:
+        return 0
+    if isinstance(freq, pd.tseries.offsets.Tick):
+        step = freq.nanos
+    else:
+        # calendar offsets step at least as far as their first step, apart
+        # from business day like offsets near weekends
+        step = ((start + freq) - start).value
+    if step <= 0:
+        raise ValueError("freq must step forward")
+    return (end - start).value // step + 1
+
+
+def _series_times(series, sites=1, freq=None):
+    """DatetimeIndex for a request with start, end, freq and timezone
+    fields, or an error message. Oversized ranges are refused before any
+    timestamps are built"""
+    limit = "At most {} site timestamps per request".format(
+        settings.SUN_SERIES_MAX_ROWS)
+    try:
+        freq = pd.tseries.frequencies.to_offset(freq or series.freq)
+        if _series_rows(series, freq) * sites > \
+                3 * settings.SUN_SERIES_MAX_ROWS:
+            return limit
+        times = pd.date_range(series.start, series.end, freq=freq,
+                              tz=series.timezone)
+    except (ValueError, TypeError, KeyError, OverflowError) as e:
+        return "Invalid time range: {}".format(e)
+    if len(times) * sites > settings.SUN_SERIES_MAX_ROWS:
+        return limit
+    return times
+
+
+def _csv_chunks(res, rows=settings.SUN_SERIES_CSV_CHUNK):
+    for start in range(0, len(res), rows):
+        yield res.iloc[start:start + rows].to_csv(
+            header=start == 0, index_label="time")
+
+
+def _epoch(times):
+    """Epoch seconds of a DatetimeIndex as int64, whatever its resolution"""
+    return times.values.astype("datetime64[s]").astype(np.int64)
+
+
+@app.post("/sun/series")
+async def sun_series(series: SunSeries, accept: Optional[str] = Header(None)):
+    invalid = _invalid_method(series.method)
+    if invalid:
+        return invalid
+    times = _series_times(series)
+    if isinstance(times, str):
+        return {"message": times}
+    # one vectorized spa_python call for the whole range, off the event loop
+    try:
+        res = await run_in_threadpool(
+            sunFun.get_solarposition, times, series.latitude,
+            series.longitude, altitude=series.altitude,
+            **solar_kwargs(series.method))
+    except SOLAR_ERRORS as e:
+        return {"message": "Solar position failed: {}".format(e)}
+    if series.format == "csv":
+        return StreamingResponse(_csv_chunks(res), media_type="text/csv")
+    media_type = formats.negotiate(accept, series.format)
+    if media_type is not None:
+        columns = {"time": _epoch(times)}
+        columns.update(_solar_columns(res))
+        return await run_in_threadpool(formats.response, media_type, columns)
+    return await run_in_threadpool(_series_json, series, times, res)
+
+
+def _series_json(series, times, res):
+    """/sun/series JSON body, rendered off the event loop"""
+    columns = _solar_columns(res)
+    out = {"timezone": series.timezone,
+           "time": _epoch(times).tolist()}
+    for column in SOLAR_COLUMNS:
+        out[column] = columns[column].tolist() if column in columns else None
+    return JSONResponse(out)
+
+
+@app.post("/sun/sites")
+async def sun_sites(sites: SunSites, accept: Optional[str] = Header(None)):
+    n = len(sites.latitudes)
+    altitudes = sites.altitudes if sites.altitudes is not None else [0.] * n
+    if n == 0 or len(sites.longitudes) != n or len(altitudes) != n:
+        return {"message": "latitudes, longitudes and altitudes must be "
+                           "non-empty and the same length"}
+    times = _series_times(sites, sites=n)
+    if isinstance(times, str):
+        return {"message": times}
+    res = await run_in_threadpool(
+        sunFun.spa_python_sites, times, sites.latitudes, sites.longitudes,
+        altitudes)
+    media_type = formats.negotiate(accept)
+    if media_type is not None:
+        # every column sites x times, time broadcast down the sites
+        columns = {"time": np.broadcast_to(_epoch(times), (n, len(times)))}
+        columns.update((column, res[column]) for column in SOLAR_COLUMNS)
+        return await run_in_threadpool(formats.response, media_type, columns)
+    return await run_in_threadpool(_sites_json, sites, times, res)
+
+
+def _sites_json(sites, times, res):
+    """/sun/sites JSON body, rendered off the event loop; each column is a
+    sites x times nested list"""
+    out = {"timezone": sites.timezone,
+           "time": _epoch(times).tolist(),
+           "latitude": sites.latitudes, "longitude": sites.longitudes}
+    for column in SOLAR_COLUMNS:
+        out[column] = res[column].tolist()
+    return JSONResponse(out)
+
+
+def _epoch_seconds(values):
+    """Nested lists of epoch seconds from datetime64 values, NaT as null"""
+    out = values.astype("datetime64[s]").astype(np.int64).astype(object)
+    out[np.isnat(values)] = None
+    return out.tolist()
+
+
+@app.post("/sun/events")
+async def sun_events(events: SunEvents):
+    n = len(events.latitudes)
+    if n == 0 or len(events.longitudes) != n:
+        return {"message": "latitudes and longitudes must be non-empty and "
+                           "the same length"}
+    days = _series_times(events, sites=n, freq="D")
+    if isinstance(days, str):
+        return {"message": days}
+    how = "numba" if settings.SOLAR_METHOD == "nrel_numba" else "numpy"
+    res = await run_in_threadpool(
+        sunFun.sun_rise_set_transit_arrays, days, events.latitudes,
+        events.longitudes, how, numthreads=settings.SPA_NUMTHREADS)
+    return await run_in_threadpool(_events_json, events, days, res)
+
+
+def _events_json(events, days, res):
+    """/sun/events JSON body, rendered off the event loop; each event is a
+    sites x days nested list, null without a rise or set"""
+    out = {"timezone": events.timezone,
+           "date": days.strftime("%Y-%m-%d").tolist(),
+           "latitude": events.latitudes, "longitude": events.longitudes}
+    for event in ("sunrise", "sunset", "transit"):
+        out[event] = _epoch_seconds(res[event])
+    return JSONResponse(out)
+
+
+@app.post("/sun/crossings")
+async def sun_crossings(crossings: SunCrossings):
+    n = len(crossings.latitudes)
+    if n == 0 or len(crossings.longitudes) != n:
+        return {"message": "latitudes and longitudes must be non-empty and "
+                           "the same length"}
+    if crossings.attribute not in SOLAR_COLUMNS[:4]:
+        return {"message": "attribute must be one of {}".format(
+            ", ".join(SOLAR_COLUMNS[:4]))}
+    days = _series_times(crossings, sites=n, freq="D")
+    if isinstance(days, str):
+        return {"message": days}
+    method = "ephemeris" if settings.SOLAR_METHOD == "ephemeris" \
+        else "nrel_numpy"
+    res = await run_in_threadpool(
+        sunFun.elevation_crossings, days, crossings.latitudes,
+        crossings.longitudes, crossings.value, crossings.attribute,
+        method=method)
+    return await run_in_threadpool(_crossings_json, crossings, days, res)
+
+
+def _crossings_json(crossings, days, res):
+    """/sun/crossings JSON body, rendered off the event loop; sites x days
+    nested lists, null when the sun never reaches value"""
+    out = {"timezone": crossings.timezone,
+           "date": days.strftime("%Y-%m-%d").tolist(),
+           "latitude": crossings.latitudes,
+           "longitude": crossings.longitudes,
+           "attribute": crossings.attribute, "value": crossings.value}
+    for event in ("rising", "setting"):
+        out[event] = _epoch_seconds(res[event])
+    return JSONResponse(out)
@@ -0,0 +1,38 @@
+"""Image preprocessing shared by training and serving.
+
+The turbidity model is trained on RGB images resized to IMAGE_SIZE with
+nearest neighbour interpolation (the ImageDataGenerator default) and
+scaled by SCALE, so anything that feeds the model should go through here.
+"""
+import numpy as np
+import cv2
+
+IMAGE_SIZE = (150, 150)
+SCALE = 1. / 255
+
+
+def allocate(n):
+    """Uninitialized float32 input buffer for n images"""
+    return np.empty((n, IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.float32)
+
+
+def preprocess_batch(images, out=None):
+    """Convert a sequence of BGR uint8 images (as decoded by OpenCV) into a
+    float32 model input batch.
+
+    Each image is resized straight into a shared uint8 staging array; the
+    BGR -> RGB swap and scaling then happen in a single vectorized pass into
+    out, which is allocated when not given.
+    """
+    n = len(images)
+    if out is None:
+        out = allocate(n)
+    else:
+        out = out[:n]
+    staging = np.empty(out.shape, dtype=np.uint8)
+    for i, image in enumerate(images):
+        cv2.resize(image, IMAGE_SIZE, dst=staging[i],
+                   interpolation=cv2.INTER_NEAREST)
+    np.multiply(staging[..., ::-1], np.float32(SCALE), out=out,
+                casting='unsafe')
+    return out
@@ -0,0 +1,105 @@
+"""Post-training quantization of the turbidity model for CPU serving.
+
+    python quantize.py --max-drop 0.01
+
+Builds a dynamic range and a full int8 TFLite variant, calibrating the
+int8 one on images from data/Train. Each variant is scored on data/Val
+against the float Keras model and only written to --out-dir when its
+accuracy is at most --max-drop below the float model's. Serve a published
+variant with MODEL_BACKEND=tflite MODEL_PATH=model-int8.tflite.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+import backends
+import export
+
+VARIANTS = ('dynamic', 'int8')
+
+
+def convert(model, variant, calibration=None):
+    """TFLite flatbuffer for one quantization variant"""
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == 'int8':
+        def representative_dataset():
+            for image in calibration:
+                yield [image[np.newaxis]]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    elif variant != 'dynamic':
+        raise ValueError('variant must be one of ' + ', '.join(VARIANTS))
+    return converter.convert()
+
+
+def accuracy(backend, images, labels, batch_size=32):
+    correct = 0
+    for start in range(0, len(images), batch_size):
+        scores = backend.predict(images[start:start + batch_size])
+        correct += int(np.sum(scores.argmax(axis=1) ==
+                              labels[start:start + batch_size]))
+    return correct / len(labels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='model.h5')
+    parser.add_argument('--train', default=os.path.join('data', 'Train'))
+    parser.add_argument('--val', default=os.path.join('data', 'Val'))
+    parser.add_argument('--calibration-size', type=int, default=200,
+                        help='number of training images used to calibrate')
+    parser.add_argument('--max-drop', type=float, default=0.01,
+                        help='largest allowed accuracy drop, as a fraction')
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS,
+                        default=list(VARIANTS))
+    parser.add_argument('--out-dir', default='.')
+    args = parser.parse_args()
+
+    reference = backends.KerasBackend(args.model)
+    images, labels = export.load_images(args.val)
+    baseline = accuracy(reference, images, labels)
+    print('float: accuracy {:.4f} on {} images'.format(baseline, len(labels)))
+
+    calibration = None
+    if 'int8' in args.variants:
+        calibration, _ = export.load_images(args.train,
+                                            limit=args.calibration_size)
+
+    published = True
+    for variant in args.variants:
+        flatbuffer = convert(reference.model, variant, calibration)
+        with tempfile.NamedTemporaryFile(suffix='.tflite',
+                                         dir=args.out_dir) as tmp:
+            tmp.write(flatbuffer)
+            tmp.flush()
+            score = accuracy(backends.TFLiteBackend(tmp.name), images, labels)
+            drop = baseline - score
+            status = 'rejected'
+            if drop <= args.max_drop:
+                path = os.path.join(args.out_dir,
+                                    'model-{}.tflite'.format(variant))
+                os.chmod(tmp.name, 0o644)
+                os.link(tmp.name, path + '.tmp')
+                os.replace(path + '.tmp', path)
+                status = 'published to ' + path
+            else:
+                published = False
+        print('{}: accuracy {:.4f} (drop {:+.4f}), {:.1f} MB, {}'.format(
+            variant, score, drop, len(flatbuffer) / 2.**20, status))
+    sys.exit(0 if published else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Multi-process launcher for main.app.
+
+    python serve.py --workers 4 --port 8000
+
+The turbidity model is loaded once, in a dedicated inference process (see
+shared_inference), instead of once per uvicorn worker. Web workers are
+forked from this launcher, share its listening socket and hand their
+preprocessed images to the inference process through shared memory, so
+adding workers scales request handling across cores without adding model
+copies.
+"""
+import argparse
+import os
+import signal
+import socket
+
+import uvicorn
+
+import settings
+import shared_inference
+
+
+def run_worker(shared, worker_id, sock, args):
+    shared.install(worker_id)
+    config = uvicorn.Config('main:app', host=args.host, port=args.port,
+                            log_level=args.log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--backend', default=None,
+                        help='model backend, defaults to MODEL_BACKEND')
+    parser.add_argument('--model-path', default=None)
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+
+    shared = shared_inference.SharedInference(
+        args.workers, settings.BATCH_MAX_SIZE, args.backend, args.model_path)
+    try:
+        shared.start()
+    except RuntimeError as e:
+        parser.exit(1, '{}\n'.format(e))
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.set_inheritable(True)
+
+    children = []
+    for worker_id in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(shared, worker_id, sock, args)
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    finally:
+        sock.close()
+        shared.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import os
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+# image fetching for the turbidity endpoint
+FETCH_CONNECT_TIMEOUT = _env_float('FETCH_CONNECT_TIMEOUT', 5.0)
+FETCH_READ_TIMEOUT = _env_float('FETCH_READ_TIMEOUT', 10.0)
+FETCH_MAX_BYTES = _env_int('FETCH_MAX_BYTES', 10 * 1024 * 1024)
+FETCH_MAX_CONNECTIONS = _env_int('FETCH_MAX_CONNECTIONS', 100)
+FETCH_MAX_KEEPALIVE = _env_int('FETCH_MAX_KEEPALIVE', 20)
+
+# micro-batching of turbidity model inference
+BATCH_MAX_SIZE = _env_int('BATCH_MAX_SIZE', 32)
+BATCH_MAX_WAIT_MS = _env_float('BATCH_MAX_WAIT_MS', 5.0)
+
+# /batch endpoint
+BATCH_MAX_IMAGES = _env_int('BATCH_MAX_IMAGES', 256)
+BATCH_STREAM_THRESHOLD = _env_int('BATCH_STREAM_THRESHOLD', 16)
+
+# turbidity prediction cache
+CACHE_MAX_ENTRIES = _env_int('CACHE_MAX_ENTRIES', 10000)
+CACHE_MAX_BYTES = _env_int('CACHE_MAX_BYTES', 16 * 1024 * 1024)
+CACHE_TTL = _env_float('CACHE_TTL', 3600.)
+CACHE_DISK_PATH = os.environ.get('CACHE_DISK_PATH', '')
+
+# turbidity model runtime: keras, tflite or onnx
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'keras')
+MODEL_PATH = os.environ.get('MODEL_PATH', '')
+MODEL_THREADS = _env_int('MODEL_THREADS', 0) or None
+
+# turbidity endpoints; disable for solar only deployments
+TURBIDITY_ENABLED = os.environ.get('TURBIDITY_ENABLED', '1') != '0'
+# load the model in the background at startup instead of on first request
+MODEL_WARMUP = os.environ.get('MODEL_WARMUP', '0') != '0'
+
+# /sun/series
+SUN_SERIES_MAX_ROWS = _env_int('SUN_SERIES_MAX_ROWS', 5 * 10**6)
+SUN_SERIES_CSV_CHUNK = _env_int('SUN_SERIES_CSV_CHUNK', 50000)
+
+# default solar position engine: nrel_numpy, nrel_numba, nrel_c, pyephem,
+# ephemeris, table or analytical; /sun and /sun/series can pick another one
+# per request, out of those whose dependencies or table are installed
+SOLAR_METHOD = os.environ.get('SOLAR_METHOD', 'nrel_numpy')
+# built with "python zenith.py", used when SOLAR_METHOD is table
+EPHEMERIS_TABLE = os.environ.get('EPHEMERIS_TABLE', 'ephemeris_table.npy')
+# answer single timestamp nrel_numpy /sun requests with the numba compiled
+# SPA loop when numba is installed: microseconds instead of milliseconds,
+# at the cost of importing and warming numba at startup (about half a
+# second and 120 MB). These requests skip the /sun result cache, so they
+# don't show in its /metrics stats; nrel_numba requests always do both
+SPA_SCALAR_NUMBA = os.environ.get('SPA_SCALAR_NUMBA', '0') != '0'
+# threads a large nrel_numba request is split across
+SPA_NUMTHREADS = _env_int('SPA_NUMTHREADS', os.cpu_count() or 1)
+# worker processes a large nrel_c or pyephem request is split across;
+# 1 computes in the request's thread
+SOLAR_PROCESSES = _env_int('SOLAR_PROCESSES', 1)
+
+# /sun result cache: positions are rounded to SOLAR_CACHE_POSITION_STEP
+# degrees and times to SOLAR_CACHE_TIME_STEP seconds; 0 entries disables it.
+# Workers share results through the sqlite file at SOLAR_CACHE_DISK_PATH
+SOLAR_CACHE_ENTRIES = _env_int('SOLAR_CACHE_ENTRIES', 10000)
+SOLAR_CACHE_POSITION_STEP = _env_float('SOLAR_CACHE_POSITION_STEP', 1e-4)
+SOLAR_CACHE_TIME_STEP = _env_float('SOLAR_CACHE_TIME_STEP', 1.)
+SOLAR_CACHE_DISK_PATH = os.environ.get('SOLAR_CACHE_DISK_PATH', '')
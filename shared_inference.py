@@ -0,0 +1,185 @@
+"""Serve one copy of the turbidity model to many worker processes.
+
+A single inference process owns the backend. Each web worker gets its own
+slot in two shared memory blocks (input images and output scores); it
+writes a preprocessed batch into its slot, posts (worker id, rows) on a
+request queue and waits on its pipe. The inference process coalesces the
+requests that are pending from all workers into one predict call, writes
+the scores back into the output slots and wakes each worker.
+"""
+import multiprocessing as mp
+import queue
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+
+import backends
+import preprocess
+
+INPUT_SHAPE = preprocess.allocate(0).shape[1:]
+N_CLASSES = 3
+
+# set in forked web workers by the launcher (serve.py); main.py uses it in
+# place of a local backend when present
+client = None
+
+
+def _views(inputs, outputs, workers, slot_rows):
+    x = np.ndarray((workers, slot_rows) + INPUT_SHAPE, dtype=np.float32,
+                   buffer=inputs.buf)
+    y = np.ndarray((workers, slot_rows, N_CLASSES), dtype=np.float32,
+                   buffer=outputs.buf)
+    return x, y
+
+
+def _reject_queued(requests, replies):
+    """Answer requests still queued behind the shutdown sentinel with an
+    error"""
+    while True:
+        try:
+            request = requests.get_nowait()
+        except queue.Empty:
+            return
+        if request is not None:
+            replies[request[0]].send('inference process stopped')
+
+
+def _serve(input_name, output_name, workers, slot_rows, requests, replies,
+           backend_name, model_path):
+    inputs = shared_memory.SharedMemory(name=input_name)
+    outputs = shared_memory.SharedMemory(name=output_name)
+    x, y = _views(inputs, outputs, workers, slot_rows)
+    model = backends.load_backend(backend_name, model_path)
+    replies[0].send(None)  # ready
+    try:
+        while True:
+            pending = [requests.get()]
+            while len(pending) < workers:
+                try:
+                    pending.append(requests.get_nowait())
+                except queue.Empty:
+                    break
+            # requests that arrived alongside the shutdown sentinel are still
+            # answered, so no worker is left waiting on its reply
+            stopping = None in pending
+            pending = [request for request in pending if request is not None]
+            if not pending:
+                _reject_queued(requests, replies)
+                return
+            try:
+                if len(pending) == 1:
+                    wid, n = pending[0]
+                    batch = x[wid, :n]
+                else:
+                    batch = np.concatenate([x[wid, :n] for wid, n in pending])
+                scores = model.predict(batch)
+                error = None
+            except Exception as e:
+                error = repr(e)
+            start = 0
+            for wid, n in pending:
+                if error is None:
+                    y[wid, :n] = scores[start:start + n]
+                    start += n
+                replies[wid].send(error)
+            if stopping:
+                _reject_queued(requests, replies)
+                return
+    finally:
+        del x, y
+        inputs.close()
+        outputs.close()
+
+
+class SharedInference:
+    """Owner side: shared memory, queues and the inference process.
+
+    Create and start it in the launcher before forking the web workers,
+    then call install(worker_id) in each of them.
+    """
+
+    def __init__(self, workers, slot_rows, backend_name=None,
+                 model_path=None):
+        self.workers = workers
+        self.slot_rows = slot_rows
+        nbytes = int(np.prod(INPUT_SHAPE)) * 4
+        self.inputs = shared_memory.SharedMemory(
+            create=True, size=workers * slot_rows * nbytes)
+        self.outputs = shared_memory.SharedMemory(
+            create=True, size=workers * slot_rows * N_CLASSES * 4)
+        # spawn so the inference process starts without the launcher's state
+        ctx = mp.get_context('spawn')
+        self.requests = ctx.Queue()
+        pipes = [ctx.Pipe(duplex=False) for _ in range(workers)]
+        self._recv = [r for r, _ in pipes]
+        self.process = ctx.Process(
+            target=_serve, name='inference',
+            args=(self.inputs.name, self.outputs.name, workers, slot_rows,
+                  self.requests, [s for _, s in pipes], backend_name,
+                  model_path))
+
+    def start(self):
+        """Start the inference process and wait for its model to load.
+
+        Raises RuntimeError, with the shared memory released, if the
+        process exits before it is ready.
+        """
+        self.process.start()
+        # wait for the model to be loaded before accepting traffic; the
+        # process sentinel wakes us if it dies first
+        ready = self._recv[0]
+        try:
+            if ready not in wait([ready, self.process.sentinel]):
+                raise EOFError
+            ready.recv()
+        except (EOFError, OSError):
+            self.process.join()
+            self._release()
+            raise RuntimeError(
+                'inference process failed to load the model '
+                '(exit code {})'.format(self.process.exitcode)) from None
+
+    def install(self, worker_id):
+        """Make this process use slot worker_id for predictions"""
+        global client
+        client = SharedInferenceClient(self, worker_id)
+        return client
+
+    def close(self):
+        self.requests.put(None)
+        self.process.join()
+        self._release()
+
+    def _release(self):
+        self.inputs.close()
+        self.outputs.close()
+        self.inputs.unlink()
+        self.outputs.unlink()
+
+
+class SharedInferenceClient:
+    """Worker side; has the predict(batch) interface of a backend"""
+
+    def __init__(self, owner, worker_id):
+        self.worker_id = worker_id
+        self.slot_rows = owner.slot_rows
+        self.requests = owner.requests
+        self.reply = owner._recv[worker_id]
+        self.x, self.y = _views(owner.inputs, owner.outputs, owner.workers,
+                                owner.slot_rows)
+        self.x = self.x[worker_id]
+        self.y = self.y[worker_id]
+
+    def predict(self, batch):
+        out = np.empty((len(batch), N_CLASSES), dtype=np.float32)
+        for start in range(0, len(batch), self.slot_rows):
+            chunk = batch[start:start + self.slot_rows]
+            n = len(chunk)
+            self.x[:n] = chunk
+            self.requests.put((self.worker_id, n))
+            error = self.reply.recv()
+            if error is not None:
+                raise RuntimeError('inference process failed: ' + error)
+            out[start:start + n] = self.y[:n]
+        return out
@@ -0,0 +1,278 @@
+"""Train the turbidity classifier with a tf.data input pipeline.
+
+    python train_turbidity.py --epochs 20 --model model.h5
+
+JPEGs are decoded and resized in parallel once, cached as uint8, then
+shuffled and batched every epoch. The ImageDataGenerator augmentations of
+the original notebook (rotation, shift, shear, zoom, horizontal flip,
+nearest fill) run as one projective transform per batch. Each epoch
+reports how many training images per second went through the model.
+"""
+import argparse
+import glob
+import math
+import os
+import time
+
+import preprocess
+
+INIT_LR = 1e-4
+EPOCHS = 20
+BS = 32
+
+# ImageDataGenerator(rotation_range=40, width_shift_range=0.2,
+# height_shift_range=0.2, shear_range=0.2, zoom_range=0.2,
+# horizontal_flip=True, fill_mode='nearest'); shear is in degrees there
+ROTATION = 40.
+SHIFT = 0.2
+SHEAR = 0.2
+ZOOM = 0.2
+
+# (height, width) of the model input
+INPUT_SIZE = (preprocess.IMAGE_SIZE[1], preprocess.IMAGE_SIZE[0])
+
+
+def list_images(directory):
+    """Image paths and class indices from a directory with one sub
+    directory per class, sorted as flow_from_directory does"""
+    classes = sorted(d for d in os.listdir(directory)
+                     if os.path.isdir(os.path.join(directory, d)))
+    paths, labels = [], []
+    for i, cls in enumerate(classes):
+        found = sorted(glob.glob(os.path.join(directory, cls, '*')))
+        paths.extend(found)
+        labels.extend([i] * len(found))
+    return paths, labels, classes
+
+
+def _nearest(size, out):
+    """Source indices of cv2.INTER_NEAREST resizing size pixels to out"""
+    import tensorflow as tf
+
+    scale = 1. / (out / tf.cast(size, tf.float64))
+    index = tf.floor(tf.range(out, dtype=tf.float64) * scale)
+    return tf.minimum(tf.cast(index, tf.int32), size - 1)
+
+
+def _decode(path, label, classes):
+    import tensorflow as tf
+
+    # the accurate IDCT and cv2's nearest neighbour indices give the same
+    # pixels as preprocess_batch on cv2.imread images, so training sees
+    # what serving does
+    image = tf.io.decode_jpeg(tf.io.read_file(path), channels=3,
+                              dct_method='INTEGER_ACCURATE')
+    shape = tf.shape(image)
+    image = tf.gather(image, _nearest(shape[0], INPUT_SIZE[0]), axis=0)
+    image = tf.gather(image, _nearest(shape[1], INPUT_SIZE[1]), axis=1)
+    # kept uint8 so the cache holds a quarter of the float32 size
+    image.set_shape(INPUT_SIZE + (3,))
+    return image, tf.one_hot(label, classes)
+
+
+def _augment(images):
+    """Random ImageDataGenerator-style affine transforms of a float batch,
+    applied in one ImageProjectiveTransformV3 call"""
+    import tensorflow as tf
+
+    n = tf.shape(images)[0]
+    height, width = INPUT_SIZE
+
+    def uniform(limit):
+        return tf.random.uniform([n], -limit, limit)
+
+    zeros = tf.zeros([n])
+    ones = tf.ones([n])
+
+    def matrix(*rows):
+        # (n, 3, 3) from nine per-image values, row major
+        return tf.reshape(tf.stack(rows, axis=1), [n, 3, 3])
+
+    theta = uniform(math.radians(ROTATION))
+    shear = uniform(math.radians(SHEAR))
+    zx = 1 + uniform(ZOOM)
+    zy = 1 + uniform(ZOOM)
+    tx = uniform(SHIFT) * width
+    ty = uniform(SHIFT) * height
+    flip = tf.cast(tf.random.uniform([n]) < 0.5, tf.float32)
+    cx = (width - 1) / 2.
+    cy = (height - 1) / 2.
+
+    # maps output pixel (x, y) to the input pixel it is sampled from:
+    # flip, then zoom, shear and rotate about the centre, then shift
+    transform = matrix(1 - 2 * flip, zeros, flip * (width - 1),
+                       zeros, ones, zeros, zeros, zeros, ones)
+    for step in (
+            matrix(ones, zeros, -cx * ones, zeros, ones, -cy * ones,
+                   zeros, zeros, ones),
+            matrix(zx, zeros, zeros, zeros, zy, zeros, zeros, zeros, ones),
+            matrix(ones, -tf.sin(shear), zeros, zeros, tf.cos(shear), zeros,
+                   zeros, zeros, ones),
+            matrix(tf.cos(theta), -tf.sin(theta), zeros,
+                   tf.sin(theta), tf.cos(theta), zeros, zeros, zeros, ones),
+            matrix(ones, zeros, cx + tx, zeros, ones, cy + ty,
+                   zeros, zeros, ones)):
+        transform = tf.matmul(step, transform)
+    transform = tf.reshape(transform, [n, 9])[:, :8]
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=images, transforms=transform,
+        output_shape=tf.constant(INPUT_SIZE), fill_value=0.,
+        interpolation='BILINEAR', fill_mode='NEAREST')
+
+
+def dataset(directory, batch_size=BS, augment=False, cache=''):
+    """Batched (images, one-hot labels) dataset and its image count and
+    class names.
+
+    Decoding runs once, in parallel, and is cached in memory or in the
+    file cache when given; shuffling, augmentation and scaling by
+    preprocess.SCALE happen per batch on every pass.
+    """
+    import tensorflow as tf
+
+    paths, labels, classes = list_images(directory)
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+    ds = ds.map(lambda path, label: _decode(path, label, len(classes)),
+                num_parallel_calls=tf.data.AUTOTUNE)
+    ds = ds.cache(cache)
+    if augment:
+        ds = ds.shuffle(len(paths), reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size)
+
+    def prepare(images, labels):
+        images = tf.cast(images, tf.float32)
+        if augment:
+            images = _augment(images)
+        return images * preprocess.SCALE, labels
+
+    ds = ds.map(prepare, num_parallel_calls=tf.data.AUTOTUNE)
+    return ds.prefetch(tf.data.AUTOTUNE), len(paths), classes
+
+
+def build_model(classes, epochs=EPOCHS, init_lr=INIT_LR):
+    from tensorflow import keras
+    from tensorflow.keras import layers
+
+    model = keras.Sequential([
+        keras.Input(shape=INPUT_SIZE + (3,)),
+        layers.Conv2D(32, kernel_size=(3, 3), activation='relu'),
+        layers.Conv2D(128, (3, 3), activation='relu'),
+        layers.MaxPooling2D(pool_size=(2, 2)),
+        layers.Dropout(0.25),
+
+        layers.Conv2D(64, (3, 3), activation='relu'),
+        layers.MaxPooling2D(pool_size=(2, 2)),
+        layers.Dropout(0.25),
+
+        layers.Conv2D(128, (3, 3), activation='relu'),
+        layers.MaxPooling2D(pool_size=(2, 2)),
+        layers.Dropout(0.25),
+
+        layers.Flatten(),
+        layers.Dense(64, activation='relu'),
+        layers.Dropout(0.5),
+        layers.Dense(classes, activation='softmax'),
+    ])
+    # the legacy Adam(lr, decay) schedule: lr / (1 + decay * iterations)
+    schedule = keras.optimizers.schedules.InverseTimeDecay(
+        init_lr, decay_steps=1, decay_rate=init_lr / epochs)
+    model.compile(loss='categorical_crossentropy',
+                  optimizer=keras.optimizers.Adam(learning_rate=schedule),
+                  metrics=['accuracy'])
+    return model
+
+
+def throughput_callback(images):
+    """Keras callback printing, and logging as images_per_sec, the
+    training images per second of each epoch, validation excluded"""
+    from tensorflow import keras
+
+    class Throughput(keras.callbacks.Callback):
+        def on_epoch_begin(self, epoch, logs=None):
+            self.start = time.perf_counter()
+            self.elapsed = None
+
+        def on_test_begin(self, logs=None):
+            if self.elapsed is None:
+                self.elapsed = time.perf_counter() - self.start
+
+        def on_epoch_end(self, epoch, logs=None):
+            if self.elapsed is None:
+                self.elapsed = time.perf_counter() - self.start
+            rate = images / self.elapsed
+            if logs is not None:
+                logs['images_per_sec'] = rate
+            print('epoch {}: {} images in {:.2f}s, {:.1f} images/s'.format(
+                epoch + 1, images, self.elapsed, rate))
+
+    return Throughput()
+
+
+def plot(history, path):
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    epochs = np.arange(1, len(history['loss']) + 1)
+    plt.style.use('ggplot')
+    plt.figure()
+    plt.plot(epochs, history['loss'], label='train_loss')
+    plt.plot(epochs, history['val_loss'], label='val_loss')
+    plt.plot(epochs, history['accuracy'], label='train_acc')
+    plt.plot(epochs, history['val_accuracy'], label='val_acc')
+    plt.title('Training Loss and Accuracy on turbidity Dataset')
+    plt.xlabel('Epoch #')
+    plt.ylabel('Loss/Accuracy')
+    plt.legend(loc='lower left')
+    plt.savefig(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('--train', default=os.path.join('data', 'Train'))
+    parser.add_argument('--val', default=os.path.join('data', 'Val'))
+    parser.add_argument('--epochs', type=int, default=EPOCHS)
+    parser.add_argument('--batch-size', type=int, default=BS)
+    parser.add_argument('--lr', type=float, default=INIT_LR)
+    parser.add_argument('--patience', type=int, default=10,
+                        help='epochs without val_accuracy gains before '
+                             'stopping')
+    parser.add_argument('--cache-dir', default='',
+                        help='cache decoded images in files here instead '
+                             'of in memory')
+    parser.add_argument('--model', default='model.h5',
+                        help='best val_accuracy model is saved here')
+    parser.add_argument('--plot', default=None,
+                        help='write loss and accuracy curves to this image')
+    args = parser.parse_args()
+
+    from tensorflow import keras
+
+    def cache(name):
+        if not args.cache_dir:
+            return ''
+        os.makedirs(args.cache_dir, exist_ok=True)
+        return os.path.join(args.cache_dir, name)
+
+    train, images, classes = dataset(args.train, args.batch_size,
+                                     augment=True, cache=cache('train'))
+    val, _, _ = dataset(args.val, args.batch_size, cache=cache('val'))
+    print('{} training images, classes {}'.format(images, classes))
+
+    model = build_model(len(classes), args.epochs, args.lr)
+    callbacks = [
+        throughput_callback(images),
+        keras.callbacks.ModelCheckpoint(args.model, monitor='val_accuracy',
+                                        verbose=1, save_best_only=True),
+        keras.callbacks.EarlyStopping(monitor='val_accuracy',
+                                      patience=args.patience, verbose=1),
+    ]
+    history = model.fit(train, validation_data=val, epochs=args.epochs,
+                        callbacks=callbacks)
+    if args.plot:
+        plot(history.history, args.plot)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""Turbidity classification endpoints.
+
+Imported by main only when settings.TURBIDITY_ENABLED is set, so solar
+only deployments never load OpenCV or a model runtime. The model itself is
+loaded on first use, or in the background at startup when
+settings.MODEL_WARMUP is set.
+"""
+import asyncio
+import json
+import time
+from typing import List
+
+import numpy as np
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from starlette.concurrency import run_in_threadpool
+
+import backends
+import cache
+import fetch
+import inference
+import preprocess
+import settings
+import shared_inference
+
+
+class Image(BaseModel):
+    imageurl: str
+
+
+class ImageUrls(BaseModel):
+    imageurls: List[str]
+
+
+router = APIRouter()
+
+# Model with the runtime picked by MODEL_BACKEND (keras, tflite, onnx),
+# unless serve.py already runs it in a shared inference process
+if shared_inference.client is not None:
+    model = shared_inference.client
+else:
+    model = backends.LazyBackend()
+batcher = inference.InferenceBatcher(model.predict)
+prediction_cache = cache.PredictionCache()
+
+
+def startup():
+    batcher.start()
+    if settings.MODEL_WARMUP and isinstance(model, backends.LazyBackend):
+        model.warm_up(np.zeros_like(preprocess.allocate(1)))
+
+
+async def shutdown():
+    await fetch.close_client()
+    batcher.stop()
+    prediction_cache.close()
+
+
+def model_status():
+    if isinstance(model, backends.LazyBackend):
+        return model.status()
+    return {"state": "ready", "error": None}
+
+
+def turbidity_label(scores):
+    (h, l, m) = scores
+    val = max(h, l, m)
+    if val == h:
+        label = "HIGH"
+    elif val == l:
+        label = "LOW"
+    else:
+        label = "MEDIUM"
+
+    # include the probability in the label
+    return "{}: {:.2f}%".format(label, val * 100)
+
+
+def turbidity_result(scores):
+    (h, l, m) = scores
+    return {"turbidity": turbidity_label(scores),
+            "probabilities": {"high": float(h), "low": float(l),
+                              "medium": float(m)}}
+
+
+async def _cached(method, *args, **kwargs):
+    """Call a prediction_cache method, in a worker thread when it may read
+    or commit to the sqlite tier"""
+    if prediction_cache.on_disk:
+        return await run_in_threadpool(method, *args, **kwargs)
+    return method(*args, **kwargs)
+
+
+def _decode(data):
+    """(content key, image) of encoded image bytes"""
+    image = fetch.decode_image(data)
+    return cache.image_key(image), image
+
+
+async def load_url(url):
+    """Fetch url -> (content key, image, cached scores or None).
+
+    image is None when the remote server confirmed through the ETag we
+    remembered that the cached result for url is still current.
+    """
+    known = prediction_cache.get_url(url)
+    if known is not None:
+        data, etag = await fetch.fetch_bytes_etag(url, known[0])
+        if data is None:
+            # a miss here is counted by the lookup after refetching
+            scores = await _cached(prediction_cache.get, known[1],
+                                   count_miss=False)
+            if scores is not None:
+                return known[1], None, scores
+            data, etag = await fetch.fetch_bytes_etag(url)
+    else:
+        data, etag = await fetch.fetch_bytes_etag(url)
+    # decoding and hashing hold the event loop for milliseconds per image
+    key, image = await run_in_threadpool(_decode, data)
+    if etag:
+        prediction_cache.put_url(url, etag, key)
+    return key, image, await _cached(prediction_cache.get, key)
+
+
+async def load_bytes(data):
+    key, image = await run_in_threadpool(_decode, data)
+    return key, image, await _cached(prediction_cache.get, key)
+
+
+async def classify(items):
+    """Scores for each loaded item, predicting the cache misses in one batch"""
+    results = [scores for _, _, scores in items]
+    missing = [i for i, scores in enumerate(results) if scores is None]
+    if missing:
+        start = time.perf_counter()
+        batch = await run_in_threadpool(preprocess.preprocess_batch,
+                                        [items[i][1] for i in missing])
+        out = await batcher.predict(batch)
+        # every image in the batch waited this long for its result
+        prediction_cache.record_miss_latency(time.perf_counter() - start,
+                                             len(missing))
+        for i, scores in zip(missing, out):
+            results[i] = scores
+        await _cached(prediction_cache.put_many,
+                      [(items[i][0], results[i]) for i in missing])
+    return results
+
+
+@router.post("/")
+async def root(image: Image):
+    if(not image.imageurl):
+        return {"message": "No Image url passed"}
+    try:
+        item = await load_url(image.imageurl)
+    except fetch.ImageFetchError as e:
+        return {"message": str(e)}
+
+    scores = (await classify([item]))[0]
+    return {"turbidity": turbidity_label(scores)}
+
+
+async def _batch_sources(request):
+    """(source, upload) pairs from a /batch body; upload is None for urls.
+    Raises ValueError with a message for a malformed body"""
+    if request.headers.get("content-type", "").startswith(
+            "application/json"):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise ValueError("Body is not valid JSON")
+        # {"imageurls": [...]} or a bare list of urls
+        if not isinstance(body, dict):
+            body = {"imageurls": body}
+        try:
+            urls = ImageUrls(**body).imageurls
+        except ValidationError as e:
+            raise ValueError("imageurls must be a list of strings: {}".format(
+                "; ".join(error["msg"] for error in e.errors())))
+        files = []
+    else:
+        form = await request.form()
+        urls = form.getlist("imageurl")
+        if not all(isinstance(url, str) for url in urls):
+            raise ValueError("imageurl fields must be strings")
+        files = [f for f in form.getlist("files") if hasattr(f, "read")]
+    return ([(url, None) for url in urls] +
+            [(upload.filename, upload) for upload in files])
+
+
+async def _load_batch_item(index, source, upload):
+    try:
+        if upload is None:
+            item = await load_url(source)
+        else:
+            item = await load_bytes(await upload.read())
+    except fetch.ImageFetchError as e:
+        return index, source, str(e)
+    return index, source, item
+
+
+@router.post("/batch")
+async def batch(request: Request):
+    try:
+        sources = await _batch_sources(request)
+    except ValueError as e:
+        return JSONResponse({"message": str(e)}, status_code=422)
+    if not sources:
+        return {"message": "No images passed"}
+    if len(sources) > settings.BATCH_MAX_IMAGES:
+        return {"message": "At most {} images per batch".format(
+            settings.BATCH_MAX_IMAGES)}
+
+    loads = [_load_batch_item(i, source, upload)
+             for i, (source, upload) in enumerate(sources)]
+
+    if len(sources) <= settings.BATCH_STREAM_THRESHOLD:
+        loaded = await asyncio.gather(*loads)
+        ok = [item for item in loaded if not isinstance(item[2], str)]
+        results = [{"index": i, "source": source, "message": err}
+                   for i, source, err in loaded if isinstance(err, str)]
+        if ok:
+            scores = await classify([item for _, _, item in ok])
+            for (i, source, _), s in zip(ok, scores):
+                results.append(dict(index=i, source=source,
+                                    **turbidity_result(s)))
+        results.sort(key=lambda r: r["index"])
+        return {"results": results}
+
+    # large batches: stream newline delimited JSON as each image finishes so
+    # clients are not held up by the slowest url. Concurrent predictions are
+    # still coalesced by the batcher.
+    async def classify_one(load):
+        i, source, item = await load
+        if isinstance(item, str):
+            return {"index": i, "source": source, "message": item}
+        scores = (await classify([item]))[0]
+        return dict(index=i, source=source, **turbidity_result(scores))
+
+    async def stream():
+        for done in asyncio.as_completed(
+                [classify_one(load) for load in loads]):
+            yield json.dumps(await done) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
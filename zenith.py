@@ -5,21 +5,24 @@
 
 
 import os
+import sys
+import atexit
+import math
+import builtins
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import importlib.util
+import sqlite3
 import datetime as dt
-try:
-    from importlib import reload
-except ImportError:
-    try:
-        from imp import reload
-    except ImportError:
-        pass
+from collections import OrderedDict, namedtuple
+from operator import itemgetter
 
 import numpy as np
 import pandas as pd
-import warnings
 
-from pvlib import atmosphere
-from pvlib.tools import datetime_to_djd, djd_to_datetime
+# pvlib is imported inside the functions that need it: importing the pvlib
+# package pulls in scipy and most of pvlib, which dominates the startup
+# time of solar only workers
 
 
 # In[8]:
@@ -40,8 +43,10 @@ def get_solarposition(time, latitude, longitude,
         altitude = 0.
         pressure = 101325.
     elif altitude is None:
+        from pvlib import atmosphere
         altitude = atmosphere.pres2alt(pressure)
     elif pressure is None:
+        from pvlib import atmosphere
         pressure = atmosphere.alt2pres(altitude)
 
     method = method.lower()
@@ -49,8 +54,8 @@ def get_solarposition(time, latitude, longitude,
         time = pd.DatetimeIndex([time, ])
 
     if method == 'nrel_c':
-        ephem_df = spa_c(time, latitude, longitude, pressure, temperature,
-                         **kwargs)
+        ephem_df = spa_c(time, latitude, longitude, pressure, altitude,
+                         temperature, **kwargs)
     elif method == 'nrel_numba':
         ephem_df = spa_python(time, latitude, longitude, altitude,
                               pressure, temperature,
@@ -67,178 +72,907 @@ def get_solarposition(time, latitude, longitude,
     elif method == 'ephemeris':
         ephem_df = ephemeris(time, latitude, longitude, pressure, temperature,
                              **kwargs)
+    elif method == 'table':
+        ephem_df = spa_table(time, latitude, longitude, altitude, pressure,
+                             temperature, **kwargs)
+    elif method == 'analytical':
+        ephem_df = analytical(time, latitude, longitude, pressure,
+                              temperature, **kwargs)
     else:
         raise ValueError('Invalid solar position method')
 
     return ephem_df
 
 
+class SolarPositionCache:
+    """LRU of single timestamp get_solarposition results.
+
+    Keys are quantized: latitude and longitude are rounded to
+    position_step degrees and time is floored to time_step seconds, and
+    the position is computed for those rounded values, so every request
+    in a bucket gets the same result no matter which one computed it.
+    With disk_path the results also go to a sqlite file that several
+    worker processes can share.
+    """
+
+    def __init__(self, max_entries=10000, position_step=1e-4, time_step=1.,
+                 disk_path=None):
+        self.max_entries = max_entries
+        self.position_step = position_step
+        self.time_step_ns = max(int(time_step * 1e9), 1)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._puts = 0
+        self._db = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, timeout=5,
+                                       check_same_thread=False)
+            # readers in other workers don't block the writer
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS solar_positions '
+                             '(key TEXT PRIMARY KEY, columns TEXT, '
+                             'vals BLOB, stored REAL)')
+            self._db.commit()
+
+    @property
+    def on_disk(self):
+        """Whether lookups may block on the sqlite tier"""
+        return self._db is not None
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_get(self, key):
+        if self._db is None:
+            return None
+        row = self._db.execute('SELECT columns, vals FROM solar_positions '
+                               'WHERE key = ?', (key, )).fetchone()
+        if row is None:
+            return None
+        entry = (tuple(row[0].split(',')),
+                 np.frombuffer(row[1], dtype=np.float64).copy())
+        self._store(key, entry)
+        self.disk_hits += 1
+        return entry
+
+    def _disk_put(self, key, entry):
+        if self._db is None:
+            return
+        self._db.execute('INSERT OR REPLACE INTO solar_positions '
+                         'VALUES (?, ?, ?, strftime(\'%s\', \'now\'))',
+                         (key, ','.join(entry[0]), entry[1].tobytes()))
+        self._puts += 1
+        if self._puts % 1000 == 0:
+            # keep the newest max_entries rows
+            self._db.execute('DELETE FROM solar_positions WHERE key NOT IN '
+                             '(SELECT key FROM solar_positions ORDER BY '
+                             'stored DESC LIMIT ?)', (self.max_entries, ))
+        self._db.commit()
+
+    def get_solarposition(self, time, latitude, longitude, altitude=None,
+                          pressure=None, method='nrel_numpy', temperature=12,
+                          **kwargs):
+        """get_solarposition for a single timestamp through the cache.
+
+        Returns a one row DataFrame indexed by time.
+        """
+        index = pd.DatetimeIndex([time])
+        bucket = int(index.values.astype('datetime64[ns]').astype(np.int64)[0])
+        bucket -= bucket % self.time_step_ns
+        lat = int(round(latitude / self.position_step))
+        lon = int(round(longitude / self.position_step))
+        # numthreads and processes change how, not what, is computed
+        options = sorted((k, v) for k, v in kwargs.items()
+                         if k not in ('numthreads', 'processes'))
+        key = '{}:{}:{}:{}:{}:{}:{}:{}'.format(
+            method.lower(), lat, lon, bucket, altitude, pressure,
+            temperature, options)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            else:
+                entry = self._disk_get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if entry is None:
+            res = get_solarposition(
+                pd.DatetimeIndex([bucket], tz='UTC'),
+                lat * self.position_step, lon * self.position_step,
+                altitude, pressure, method, temperature, **kwargs)
+            entry = (tuple(res.columns),
+                     res.values[0].astype(np.float64))
+            with self._lock:
+                self._store(key, entry)
+                self._disk_put(key, entry)
+
+        return pd.DataFrame([entry[1]], columns=list(entry[0]), index=index)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'disk_hits': self.disk_hits,
+                    'hit_rate': self.hits / lookups if lookups else 0.}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
 # In[10]:
 
 
-def spa_c(time, latitude, longitude, pressure=101325, altitude=0,
-          temperature=12, delta_t=67.0,
-          raw_spa_output=False):
+_process_pools = {}
+
+
+def _process_pool(processes):
+    with _spa_lock:
+        pool = _process_pools.get(processes)
+        if pool is None:
+            # spawn so workers start clean instead of forking the threads of
+            # a running server
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            pool = _process_pools[processes] = ProcessPoolExecutor(
+                processes, mp_context=multiprocessing.get_context('spawn'))
+    return pool
 
-    # Added by Rob Andrews (@Calama-Consulting), Calama Consulting, 2014
-    # Edited by Will Holmgren (@wholmgren), University of Arizona, 2014
-    # Edited by Tony Lorenzo (@alorenzo175), University of Arizona, 2015
 
+def shutdown_process_pools():
+    """Stop the worker processes of nrel_c and pyephem requests; a later
+    request starts a new pool"""
+    with _spa_lock:
+        pools = list(_process_pools.values())
+        _process_pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+atexit.register(shutdown_process_pools)
+
+
+def _pooled_columns(call, values, args, rows, processes, min_chunk):
+    """call(values[a:b], *args), a (rows, b - a) array, over all of values.
+
+    Long inputs are split into one chunk per process, each at least
+    min_chunk long, and the chunks written into one preallocated array.
+    """
+    chunks = min(processes, len(values) // min_chunk)
+    if chunks <= 1:
+        return call(values, *args)
+    out = np.empty((rows, len(values)))
+    bounds = np.linspace(0, len(values), chunks + 1).astype(int)
+    pool = _process_pool(processes)
+    futures = [(a, b, pool.submit(call, values[a:b], *args))
+               for a, b in zip(bounds[:-1], bounds[1:])]
+    for a, b, future in futures:
+        out[:, a:b] = future.result()
+    return out
+
+
+# time ranges are only split across processes in chunks of at least this
+# many timestamps; smaller inputs don't cover the cost of shipping them
+SPA_C_MIN_CHUNK = 20000
+
+# calendar fields are converted to Python ints this many rows at a time
+SPA_C_BLOCK = 10000
+
+# spa_calc outputs behind the default spa_c columns
+SPA_C_COLUMNS = ('azimuth', 'zenith', 'e', 'e0')
+
+
+def _spa_calc():
     try:
         from pvlib.spa_c_files.spa_py import spa_calc
     except ImportError:
         raise ImportError('Could not import built-in SPA calculator. ' +
                           'You may need to recompile the SPA code.')
+    return spa_calc
+
+
+def _calendar_fields(values):
+    """UTC year, month, day, hour, minute and whole second integer arrays
+    of datetime64 values"""
+    years = values.astype('datetime64[Y]')
+    months = values.astype('datetime64[M]')
+    days = values.astype('datetime64[D]')
+    seconds = (values - days).astype('timedelta64[s]').astype(np.int64)
+    return (years.astype(np.int64) + 1970,
+            (months - years).astype(np.int64) + 1,
+            (days - months).astype(np.int64) + 1,
+            seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def _spa_c_positions(values, latitude, longitude, altitude, pressure,
+                     temperature, delta_t, columns):
+    """spa_calc outputs named by columns for datetime64 UTC values, as a
+    (len(columns), len(values)) array"""
+    spa_calc = _spa_calc()
+    site = dict(time_zone=0, latitude=latitude, longitude=longitude,
+                elevation=altitude, pressure=pressure / 100,
+                temperature=temperature, delta_t=delta_t)
+    outputs = itemgetter(*columns)
+
+    def fields():
+        # calendar fields as Python ints, SPA_C_BLOCK rows at a time so
+        # long series never hold six full lists
+        for start in range(0, len(values), SPA_C_BLOCK):
+            block = _calendar_fields(values[start:start + SPA_C_BLOCK])
+            yield from zip(*(field.tolist() for field in block))
+
+    # filled row by row straight from the generator into a preallocated
+    # (len(values), len(columns)) array
+    out = np.fromiter(
+        (outputs(spa_calc(year=year, month=month, day=day, hour=hour,
+                          minute=minute, second=second, **site))
+         for year, month, day, hour, minute, second in fields()),
+        dtype=np.dtype((np.float64, len(columns))), count=len(values))
+    return out.T
 
-    # if localized, convert to UTC. otherwise, assume UTC.
-    try:
-        time_utc = time.tz_convert('UTC')
-    except TypeError:
-        time_utc = time
-
-    spa_out = []
-
-    for date in time_utc:
-        spa_out.append(spa_calc(year=date.year,
-                                month=date.month,
-                                day=date.day,
-                                hour=date.hour,
-                                minute=date.minute,
-                                second=date.second,
-                                time_zone=0,  # date uses utc time
-                                latitude=latitude,
-                                longitude=longitude,
-                                elevation=altitude,
-                                pressure=pressure / 100,
-                                temperature=temperature,
-                                delta_t=delta_t
-                                ))
-
-    spa_df = pd.DataFrame(spa_out, index=time)
+
+def spa_c(time, latitude, longitude, pressure=101325, altitude=0,
+          temperature=12, delta_t=67.0,
+          raw_spa_output=False, processes=1):
+    """Solar position from the NREL SPA C code.
+
+    Calendar fields are taken apart for the whole index at once and
+    results written into preallocated columns. spa_calc holds the GIL, so
+    with processes > 1 long time ranges are split across a pool of worker
+    processes instead of threads.
+    """
+
+    # Added by Rob Andrews (@Calama-Consulting), Calama Consulting, 2014
+    # Edited by Will Holmgren (@wholmgren), University of Arizona, 2014
+    # Edited by Tony Lorenzo (@alorenzo175), University of Arizona, 2015
+
+    spa_calc = _spa_calc()
+
+    # DatetimeIndex.values is UTC when localized; naive times are UTC
+    values = time.values.astype('datetime64[ns]')
+
+    if raw_spa_output:
+        # every numeric spa_calc output, in its own order
+        sample = spa_calc(year=2000, month=1, day=1, hour=12, minute=0,
+                          second=0, time_zone=0, latitude=latitude,
+                          longitude=longitude, elevation=altitude,
+                          pressure=pressure / 100, temperature=temperature,
+                          delta_t=delta_t)
+        columns = tuple(sample)
+    else:
+        columns = SPA_C_COLUMNS
+    out = _pooled_columns(
+        _spa_c_positions, values,
+        (latitude, longitude, altitude, pressure, temperature, delta_t,
+         columns), len(columns), processes, SPA_C_MIN_CHUNK)
+    spa = dict(zip(columns, out))
 
     if raw_spa_output:
         # rename "time_zone" from raw output from spa_c_files.spa_py.spa_calc()
         # to "timezone" to match the API of pvlib.solarposition.spa_c()
-        return spa_df.rename(columns={'time_zone': 'timezone'})
+        return pd.DataFrame(spa, index=time).rename(
+            columns={'time_zone': 'timezone'})
     else:
-        dfout = pd.DataFrame({'azimuth': spa_df['azimuth'],
-                              'apparent_zenith': spa_df['zenith'],
-                              'apparent_elevation': spa_df['e'],
-                              'elevation': spa_df['e0'],
-                              'zenith': 90 - spa_df['e0']})
+        dfout = pd.DataFrame({'azimuth': spa['azimuth'],
+                              'apparent_zenith': spa['zenith'],
+                              'apparent_elevation': spa['e'],
+                              'elevation': spa['e0'],
+                              'zenith': 90 - spa['e0']}, index=time)
 
         return dfout
 
 
+_spa_modules = {}
+_spa_lock = threading.Lock()
+
+
+class _CachedNumba:
+    def __init__(self, numba):
+        self._numba = numba
+
+    def __getattr__(self, name):
+        return getattr(self._numba, name)
+
+    def jit(self, *args, **kwargs):
+        kwargs.setdefault('cache', True)
+        return self._numba.jit(*args, **kwargs)
+
+
+def _cached_numba_import(name, *args, **kwargs):
+    module = builtins.__import__(name, *args, **kwargs)
+    if name == 'numba':
+        return _CachedNumba(module)
+    return module
+
+
+def _load_spa(how):
+    """Load a private copy of pvlib's spa.py compiled for how.
+
+    spa.py decides at import time whether to compile with numba based on
+    PVLIB_USE_NUMBA, so each variant gets its own module instance loaded
+    straight from the file; the pvlib package itself is not imported.
+    """
+    pvlib_dir = importlib.util.find_spec('pvlib').submodule_search_locations
+    path = os.path.join(list(pvlib_dir)[0], 'spa.py')
+    name = 'pvlib_spa_' + how
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    if how == 'numba':
+        # have spa's own "from numba import jit" see a jit that caches the
+        # compiled functions on disk, so only the first process ever pays
+        # for compilation
+        module.__builtins__ = dict(vars(builtins),
+                                   __import__=_cached_numba_import)
+    # registered before executing, as a regular import would, so numba can
+    # find the module again when it loads cached functions
+    sys.modules[name] = module
+    previous = os.environ.get('PVLIB_USE_NUMBA')
+    os.environ['PVLIB_USE_NUMBA'] = '1' if how == 'numba' else '0'
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    finally:
+        if previous is None:
+            del os.environ['PVLIB_USE_NUMBA']
+        else:
+            os.environ['PVLIB_USE_NUMBA'] = previous
+    return module
+
+
 def _spa_python_import(how):
-    """Compile spa.py appropriately"""
-
-    from pvlib import spa
-
-    # check to see if the spa module was compiled with numba
-    using_numba = spa.USE_NUMBA
-
-    if how == 'numpy' and using_numba:
-        # the spa module was compiled to numba code, so we need to
-        # reload the module without compiling
-        # the PVLIB_USE_NUMBA env variable is used to tell the module
-        # to not compile with numba
-        warnings.warn('Reloading spa to use numpy')
-        os.environ['PVLIB_USE_NUMBA'] = '0'
-        spa = reload(spa)
-        del os.environ['PVLIB_USE_NUMBA']
-    elif how == 'numba' and not using_numba:
-        # The spa module was not compiled to numba code, so set
-        # PVLIB_USE_NUMBA so it does compile to numba on reload.
-        warnings.warn('Reloading spa to use numba')
-        os.environ['PVLIB_USE_NUMBA'] = '1'
-        spa = reload(spa)
-        del os.environ['PVLIB_USE_NUMBA']
-    elif how != 'numba' and how != 'numpy':
+    """Return the spa module compiled for how ('numpy' or 'numba').
+
+    Both variants are loaded once and kept side by side, so alternating
+    between them never reloads or recompiles anything.
+    """
+    try:
+        return _spa_modules[how]
+    except KeyError:
+        pass
+    if how != 'numba' and how != 'numpy':
         raise ValueError("how must be either 'numba' or 'numpy'")
+    with _spa_lock:
+        if how not in _spa_modules:
+            _spa_modules[how] = _load_spa(how)
+    return _spa_modules[how]
+
+
+# numba inputs are only split across threads in chunks of at least this
+# many timestamps; below that thread hand-off costs more than it saves
+NUMBA_MIN_CHUNK = 20000
+
+_spa_pools = {}
+
+
+def _spa_pool(numthreads):
+    with _spa_lock:
+        pool = _spa_pools.get(numthreads)
+        if pool is None:
+            pool = _spa_pools[numthreads] = ThreadPoolExecutor(
+                numthreads, thread_name_prefix='spa')
+    return pool
+
+
+def _map_chunks(call, length, numthreads):
+    """Run call(start, stop) over up to numthreads contiguous chunks of
+    length on the pooled threads, inline when the input is small"""
+    chunks = min(numthreads, length // NUMBA_MIN_CHUNK)
+    if chunks <= 1:
+        call(0, length)
+        return
+    bounds = np.linspace(0, length, chunks + 1).astype(int)
+    pool = _spa_pool(numthreads)
+    futures = [pool.submit(call, a, b)
+               for a, b in zip(bounds[:-1], bounds[1:])]
+    for future in futures:
+        future.result()
+
+
+def _solar_position_numba(spa, unixtime, lat, lon, elev, pressure, temp,
+                          delta_t, atmos_refract, numthreads):
+    """spa.solar_position_numba on a persistent thread pool.
+
+    The compiled loop releases the GIL, so large inputs are split into
+    numthreads chunks that run concurrently instead of spawning new threads
+    on every call.
+    """
+    loc_args = np.array([lat, lon, elev, pressure, temp, atmos_refract,
+                         0, 0], dtype=np.float64)
+    unixtime = np.ascontiguousarray(unixtime, dtype=np.float64)
+    delta_t = np.broadcast_to(delta_t, unixtime.shape).astype(np.float64)
+    result = np.empty((6, len(unixtime)), dtype=np.float64)
+    _map_chunks(lambda a, b: spa.solar_position_loop(
+        unixtime[a:b], delta_t[a:b], loc_args, result[:, a:b]),
+        len(unixtime), numthreads)
+    return result
+
+
+def numba_available():
+    return importlib.util.find_spec('numba') is not None
+
+
+def _spa_c_built():
+    """Whether pvlib's SPA C extension is compiled, found on disk so that
+    neither pvlib nor scipy get imported"""
+    import importlib.machinery
+
+    spec = importlib.util.find_spec('pvlib')
+    if spec is None:
+        return False
+    return any(os.path.exists(os.path.join(path, 'spa_c_files',
+                                           'spa_py' + suffix))
+               for path in spec.submodule_search_locations
+               for suffix in importlib.machinery.EXTENSION_SUFFIXES)
 
-    return spa
+
+def available_methods(table=None):
+    """get_solarposition methods that can run here: nrel_numba needs numba,
+    nrel_c the compiled SPA extension, pyephem ephem and table a built
+    ephemeris table at table"""
+    methods = ['nrel_numpy', 'ephemeris', 'analytical']
+    if numba_available():
+        methods.append('nrel_numba')
+    if _spa_c_built():
+        methods.append('nrel_c')
+    if importlib.util.find_spec('ephem') is not None:
+        methods.append('pyephem')
+    if table and os.path.exists(table):
+        methods.append('table')
+    return methods
+
+
+def warm_up(how='numba'):
+    """Load (and for numba compile or load from the JIT cache) the spa
+    module for how, so the first real request does not pay for it"""
+    spa_python(pd.DatetimeIndex(['2020-01-01T12:00:00Z']), 0., 0., how=how,
+               numthreads=1)
 
 
 # In[11]:
 
 
+SolarPosition = namedtuple('SolarPosition', (
+    'apparent_zenith', 'zenith', 'apparent_elevation', 'elevation',
+    'azimuth', 'equation_of_time'))
+
+
+def solar_position_arrays(unixtime, latitude, longitude, altitude=0,
+                          pressure=101325, temperature=12, delta_t=67.0,
+                          atmos_refract=None, how='numpy', numthreads=4):
+    """spa_python on float64 unix seconds, without pandas.
+
+    Returns a SolarPosition of arrays shaped like unixtime. numpy's per
+    call overhead dominates small inputs: for a single timestamp
+    how='numba' is a few microseconds against milliseconds.
+    """
+    unixtime = np.atleast_1d(np.asarray(unixtime, dtype=np.float64))
+    pressure = pressure / 100  # pressure must be in millibars for calculation
+
+    atmos_refract = atmos_refract or 0.5667
+
+    spa = _spa_python_import(how)
+
+    if delta_t is None or (np.ndim(delta_t) == 0 and not delta_t):
+        values = (unixtime * 1e9).astype(np.int64).view('datetime64[ns]')
+        years = values.astype('datetime64[Y]')
+        months = (values.astype('datetime64[M]') - years).astype(int) + 1
+        delta_t = spa.calculate_deltat(years.astype(int) + 1970, months)
+
+    if spa.USE_NUMBA:
+        position = _solar_position_numba(
+            spa, unixtime, latitude, longitude, altitude, pressure,
+            temperature, delta_t, atmos_refract, numthreads)
+    else:
+        position = spa.solar_position(
+            unixtime, latitude, longitude, altitude, pressure, temperature,
+            delta_t, atmos_refract, numthreads)
+    return SolarPosition(*position)
+
+
 def spa_python(time, latitude, longitude,
                altitude=0, pressure=101325, temperature=12, delta_t=67.0,
                atmos_refract=None, how='numpy', numthreads=4, **kwargs):
 
     # Added by Tony Lorenzo (@alorenzo175), University of Arizona, 2015
 
-    lat = latitude
-    lon = longitude
-    elev = altitude
-    pressure = pressure / 100  # pressure must be in millibars for calculation
+    if not isinstance(time, pd.DatetimeIndex):
+        try:
+            time = pd.DatetimeIndex(time)
+        except (TypeError, ValueError):
+            time = pd.DatetimeIndex([time, ])
+
+    unixtime = np.array(time.astype(np.int64)/10**9)
+
+    position = solar_position_arrays(
+        unixtime, latitude, longitude, altitude, pressure, temperature,
+        delta_t, atmos_refract, how, numthreads)
+
+    return pd.DataFrame(position._asdict(), index=time)
 
-    atmos_refract = atmos_refract or 0.5667
 
+def _spa_time_terms(spa, unixtime, delta_t):
+    """Observer independent SPA terms for an array of unix times.
+
+    Returns earth radius vector, apparent sidereal time, geocentric right
+    ascension and declination and the equation of time; these only depend on
+    time and can be shared by every site.
+    """
+    jd = spa.julian_day(unixtime)
+    jde = spa.julian_ephemeris_day(jd, delta_t)
+    jc = spa.julian_century(jd)
+    jce = spa.julian_ephemeris_century(jde)
+    jme = spa.julian_ephemeris_millennium(jce)
+    R = spa.heliocentric_radius_vector(jme)
+    L = spa.heliocentric_longitude(jme)
+    B = spa.heliocentric_latitude(jme)
+    Theta = spa.geocentric_longitude(L)
+    beta = spa.geocentric_latitude(B)
+    x0 = spa.mean_elongation(jce)
+    x1 = spa.mean_anomaly_sun(jce)
+    x2 = spa.mean_anomaly_moon(jce)
+    x3 = spa.moon_argument_latitude(jce)
+    x4 = spa.moon_ascending_longitude(jce)
+    l_o_nutation = np.empty((2, len(x0)))
+    spa.longitude_obliquity_nutation(jce, x0, x1, x2, x3, x4, l_o_nutation)
+    delta_psi = l_o_nutation[0]
+    delta_epsilon = l_o_nutation[1]
+    epsilon0 = spa.mean_ecliptic_obliquity(jme)
+    epsilon = spa.true_ecliptic_obliquity(epsilon0, delta_epsilon)
+    delta_tau = spa.aberration_correction(R)
+    lamd = spa.apparent_sun_longitude(Theta, delta_psi, delta_tau)
+    v0 = spa.mean_sidereal_time(jd, jc)
+    v = spa.apparent_sidereal_time(v0, delta_psi, epsilon)
+    alpha = spa.geocentric_sun_right_ascension(lamd, epsilon, beta)
+    delta = spa.geocentric_sun_declination(lamd, epsilon, beta)
+    m = spa.sun_mean_longitude(jme)
+    eot = spa.equation_of_time(m, alpha, delta_psi, epsilon)
+    return R, v, alpha, delta, eot
+
+
+def _spa_observer_terms(spa, R, v, alpha, delta, lat, lon, elev, pressure,
+                        temp, atmos_refract):
+    """Topocentric SPA terms; observer arguments broadcast against time.
+
+    pressure is in millibars. Returns apparent zenith, zenith, apparent
+    elevation, elevation and azimuth.
+    """
+    H = spa.local_hour_angle(v, lon, alpha)
+    xi = spa.equatorial_horizontal_parallax(R)
+    u = spa.uterm(lat)
+    x = spa.xterm(u, lat, elev)
+    y = spa.yterm(u, lat, elev)
+    delta_alpha = spa.parallax_sun_right_ascension(x, xi, H, delta)
+    delta_prime = spa.topocentric_sun_declination(delta, x, y, xi,
+                                                  delta_alpha, H)
+    H_prime = spa.topocentric_local_hour_angle(H, delta_alpha)
+    e0 = spa.topocentric_elevation_angle_without_atmosphere(lat, delta_prime,
+                                                            H_prime)
+    delta_e = spa.atmospheric_refraction_correction(pressure, temp, e0,
+                                                    atmos_refract)
+    e = spa.topocentric_elevation_angle(e0, delta_e)
+    theta = spa.topocentric_zenith_angle(e)
+    theta0 = spa.topocentric_zenith_angle(e0)
+    gamma = spa.topocentric_astronomers_azimuth(H_prime, delta_prime, lat)
+    phi = spa.topocentric_azimuth_angle(gamma)
+    return theta, theta0, e, e0, phi
+
+
+def spa_python_sites(time, latitudes, longitudes, altitudes=0,
+                     pressure=101325, temperature=12, delta_t=67.0,
+                     atmos_refract=None):
+    """Solar position for many sites sharing one time index.
+
+    The time dependent part of SPA (Julian days, nutation, obliquity,
+    geocentric sun position) is evaluated once for time; only the
+    observer dependent terms are broadcast over the sites. altitudes,
+    pressure and temperature may be scalars or one value per site.
+
+    Returns a dict of (n_sites, n_times) arrays with the same keys as the
+    spa_python columns.
+    """
     if not isinstance(time, pd.DatetimeIndex):
         try:
             time = pd.DatetimeIndex(time)
         except (TypeError, ValueError):
             time = pd.DatetimeIndex([time, ])
 
+    def per_site(value):
+        return np.reshape(np.asarray(value, dtype=np.float64), (-1, 1))
+
+    lat = per_site(latitudes)
+    lon = per_site(longitudes)
+    elev = per_site(altitudes)
+    pressure = per_site(pressure) / 100  # millibars
+    temperature = per_site(temperature)
+    atmos_refract = atmos_refract or 0.5667
+
     unixtime = np.array(time.astype(np.int64)/10**9)
 
-    spa = _spa_python_import(how)
+    spa = _spa_python_import('numpy')
 
     delta_t = delta_t or spa.calculate_deltat(time.year, time.month)
 
-    app_zenith, zenith, app_elevation, elevation, azimuth, eot = spa.solar_position(
-        unixtime, lat, lon, elev, pressure, temperature, delta_t, atmos_refract, numthreads)
+    R, v, alpha, delta, eot = _spa_time_terms(spa, unixtime, delta_t)
+    app_zenith, zenith, app_elevation, elevation, azimuth = \
+        _spa_observer_terms(spa, R, v, alpha, delta, lat, lon, elev,
+                            pressure, temperature, atmos_refract)
 
-    result = pd.DataFrame({'apparent_zenith': app_zenith, 'zenith': zenith,
-                           'apparent_elevation': app_elevation,
-                           'elevation': elevation, 'azimuth': azimuth,
-                           'equation_of_time': eot},
-                          index=time)
+    shape = (len(lat), len(unixtime))
+    return {'apparent_zenith': app_zenith, 'zenith': zenith,
+            'apparent_elevation': app_elevation, 'elevation': elevation,
+            'azimuth': azimuth,
+            'equation_of_time': np.broadcast_to(eot, shape)}
 
-    return result
+
+# columns of an ephemeris table, after the header row
+_TABLE_TERMS = ('R', 'v', 'alpha', 'delta', 'eot')
+_ephemeris_tables = {}
+
+
+def build_ephemeris_table(path, start_year, end_year, step=60,
+                          delta_t=67.0, chunk=100000):
+    """Precompute the time dependent SPA terms and save them as .npy.
+
+    Rows are earth radius vector, apparent sidereal time, geocentric right
+    ascension and declination and equation of time every step seconds from
+    the start of start_year to the start of end_year + 1 (UTC). Sidereal
+    time and right ascension are stored unwrapped so they can be linearly
+    interpolated. Row 0 is a header of (first unix time, step, delta_t).
+    The array is written chunk rows at a time so memory use stays bounded.
+    """
+    first = pd.Timestamp(year=start_year, month=1, day=1, tz='UTC').value
+    last = pd.Timestamp(year=end_year + 1, month=1, day=1, tz='UTC').value
+    first, last = first / 1e9, last / 1e9
+    n = int((last - first) // step) + 1
+    spa = _spa_python_import('numpy')
+
+    table = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64,
+                                      shape=(n + 1, len(_TABLE_TERMS)))
+    table[0] = (first, step, delta_t, 0, 0)
+    previous = {}
+    for start in range(0, n, chunk):
+        unixtime = first + step * np.arange(start, min(start + chunk, n),
+                                            dtype=np.float64)
+        terms = dict(zip(_TABLE_TERMS,
+                         _spa_time_terms(spa, unixtime, delta_t)))
+        for name in ('v', 'alpha'):
+            # continue the unwrapping from the end of the previous chunk
+            values = terms[name]
+            if name in previous:
+                values = np.concatenate([[previous[name]], values])
+                values = np.unwrap(values, period=360)[1:]
+            else:
+                values = np.unwrap(values, period=360)
+            previous[name] = values[-1]
+            terms[name] = values
+        table[1 + start:1 + start + len(unixtime)] = np.column_stack(
+            [terms[name] for name in _TABLE_TERMS])
+    table.flush()
+    del table
+
+
+def load_ephemeris_table(path):
+    """Memory map an ephemeris table, caching it per path"""
+    table = _ephemeris_tables.get(path)
+    if table is None:
+        table = _ephemeris_tables[path] = np.load(path, mmap_mode='r')
+    return table
+
+
+def spa_table(time, latitude, longitude, altitude=0, pressure=101325,
+              temperature=12, atmos_refract=None,
+              table='ephemeris_table.npy', **kwargs):
+    """Fast solar position from a precomputed ephemeris table.
+
+    The time dependent SPA terms are linearly interpolated from the
+    memory mapped table built by build_ephemeris_table; only the observer
+    dependent geometry is computed. With the default one minute step the
+    result differs from spa_python (with the table's delta_t) by less than
+    1e-6 degrees in zenith and elevation and 1e-8 minutes in the equation
+    of time. Azimuth error stays below 3e-5 degrees for zenith angles
+    between 1 and 179 degrees; within a degree of the zenith or the nadir
+    it grows as 1 / sin(zenith), and timestamps between table rows have
+    shown up to 2.7e-4 degrees there.
+
+    Raises ValueError for times outside the table.
+    """
+    if not isinstance(time, pd.DatetimeIndex):
+        try:
+            time = pd.DatetimeIndex(time)
+        except (TypeError, ValueError):
+            time = pd.DatetimeIndex([time, ])
+
+    data = load_ephemeris_table(table)
+    first, step, delta_t = data[0, :3]
+    n = len(data) - 1
+
+    unixtime = np.array(time.astype(np.int64)/10**9)
+    pos = (unixtime - first) / step
+    if len(pos) and (pos.min() < 0 or pos.max() > n - 1):
+        raise ValueError('times outside the ephemeris table range')
+    i = np.minimum(np.floor(pos).astype(np.int64), n - 2)
+    frac = (pos - i)[:, np.newaxis]
+    # fancy indexing only touches the pages of the mapped file we need
+    lo = data[1 + i]
+    hi = data[2 + i]
+    R, v, alpha, delta, eot = (lo + (hi - lo) * frac).T
+    v = v % 360
+    alpha = alpha % 360
+
+    spa = _spa_python_import('numpy')
+    app_zenith, zenith, app_elevation, elevation, azimuth = \
+        _spa_observer_terms(spa, R, v, alpha, delta, latitude, longitude,
+                            altitude, pressure / 100, temperature,
+                            atmos_refract or 0.5667)
+
+    return pd.DataFrame({'apparent_zenith': app_zenith, 'zenith': zenith,
+                         'apparent_elevation': app_elevation,
+                         'elevation': elevation, 'azimuth': azimuth,
+                         'equation_of_time': eot},
+                        index=time)
 
 
 # In[12]:
 
 
+def _utc_midnights(times):
+    """Unix time of 00:00 UTC on each (local) calendar date of times"""
+    if times.tz is not None:
+        times = times.tz_localize(None)
+    days = times.normalize().values.astype('datetime64[s]')
+    return days.astype(np.int64).astype(np.float64)
+
+
+def _unix_to_datetime64(seconds):
+    """datetime64[ns] array from float unix seconds; nan becomes NaT"""
+    missing = np.isnan(seconds)
+    ns = np.where(missing, 0, seconds * 1e9).astype(np.int64)
+    ns[missing] = np.iinfo(np.int64).min
+    return ns.view('datetime64[ns]')
+
+
+def _transit_sunrise_sunset(spa, utday, lat, lon, delta_t, numthreads):
+    """pvlib.spa.transit_sunrise_sunset with the observer broadcast.
+
+    The geocentric sun terms for each day and its neighbours are
+    computed in a single solar_position call shared by every site; lat
+    and lon may be scalars or (n_sites, 1) arrays. Returns transit,
+    sunrise and sunset in unix seconds, nan where the sun does not rise
+    or set.
+    """
+    if ((utday % 86400) != 0.0).any():
+        raise ValueError('Input dates must be at 00:00 UTC')
+
+    ndays = len(utday)
+    delta_t = np.broadcast_to(np.asarray(delta_t, dtype=np.float64),
+                              (ndays,))
+    ttday0 = utday - delta_t
+    unixtime = np.concatenate([utday, ttday0 - 86400, ttday0,
+                               ttday0 + 86400])
+    v, alpha, delta = spa.solar_position(unixtime, 0, 0, 0, 0, 0,
+                                         np.tile(delta_t, 4), 0, numthreads,
+                                         sst=True)
+    v = v[:ndays]
+    alpha = alpha[ndays:].reshape(3, ndays)
+    delta = delta[ndays:].reshape(3, ndays)
+
+    # day to day changes, wrapped where right ascension passes 360
+    ab = np.diff(alpha, axis=0)
+    ab[abs(ab) > 2] %= 1
+    abp = np.diff(delta, axis=0)
+    abp[abs(abp) > 2] %= 1
+    a, b = ab
+    ap, bp = abp
+    c = b - a
+    cp = bp - ap
+
+    lat_rad = np.radians(lat)
+    m0 = (alpha[1] - lon - v) / 360
+    cos_arg = ((np.sin(np.radians(-0.8333)) - np.sin(lat_rad) *
+                np.sin(np.radians(delta[1]))) /
+               (np.cos(lat_rad) * np.cos(np.radians(delta[1]))))
+    cos_arg = np.where(abs(cos_arg) > 1, np.nan, cos_arg)
+    H0 = np.degrees(np.arccos(cos_arg)) % 180
+
+    m = np.empty((3,) + np.shape(H0))
+    m[0] = m0 % 1
+    m[1] = m[0] - H0 / 360
+    m[2] = m[0] + H0 / 360
+
+    # fractions of a day that fall on the next or previous UTC day
+    add_a_day = m[2] >= 1
+    sub_a_day = m[1] < 0
+    m[1:] %= 1
+    vs = v + 360.985647 * m
+    n = m + delta_t / 86400
+
+    alpha_prime = alpha[1] + (n * (a + b + c * n)) / 2
+    delta_prime = np.radians(delta[1] + (n * (ap + bp + cp * n)) / 2)
+    Hp = (vs + lon - alpha_prime) % 360
+    Hp[Hp >= 180] -= 360
+
+    h = np.degrees(np.arcsin(np.sin(lat_rad) * np.sin(delta_prime) +
+                             np.cos(lat_rad) * np.cos(delta_prime) *
+                             np.cos(np.radians(Hp))))
+
+    transit = (m[0] - Hp[0] / 360) * 86400 + utday
+    sunrise, sunset = (m[1:] + (h[1:] + 0.8333) / (
+        360 * np.cos(delta_prime[1:]) * np.cos(lat_rad) *
+        np.sin(np.radians(Hp[1:])))) * 86400 + utday
+    sunset[add_a_day] += 86400
+    sunrise[sub_a_day] -= 86400
+    return transit, sunrise, sunset
+
+
+def sun_rise_set_transit_arrays(days, latitude, longitude, how='numpy',
+                                delta_t=67.0, numthreads=4):
+    """Sunrise, sunset and transit for many days and sites at once.
+
+    Uses the NREL SPA sunrise/sunset/transit algorithm for the calendar
+    date of each entry of days (local dates if days is localized).
+    latitude and longitude are scalars or equal length sequences of
+    sites; the geocentric terms are computed once per day and broadcast
+    over the sites.
+
+    Returns a dict of datetime64[ns] UTC arrays with keys sunrise, sunset
+    and transit, shaped (n_days,) for a scalar site or (n_sites, n_days).
+    Days without a sunrise or sunset are NaT.
+    """
+    if not isinstance(days, pd.DatetimeIndex):
+        days = pd.DatetimeIndex(np.atleast_1d(days))
+
+    lat = np.asarray(latitude, dtype=np.float64)
+    lon = np.asarray(longitude, dtype=np.float64)
+    if lat.shape != lon.shape or lat.ndim > 1:
+        raise ValueError('latitude and longitude must be scalars or '
+                         'equal length sequences')
+    if lat.ndim:
+        lat = lat[:, None]
+        lon = lon[:, None]
+
+    spa = _spa_python_import(how)
+
+    delta_t = delta_t or spa.calculate_deltat(days.year, days.month)
+
+    transit, sunrise, sunset = _transit_sunrise_sunset(
+        spa, _utc_midnights(days), lat, lon, delta_t, numthreads)
+    return {'sunrise': _unix_to_datetime64(sunrise),
+            'sunset': _unix_to_datetime64(sunset),
+            'transit': _unix_to_datetime64(transit)}
+
+
 def sun_rise_set_transit_spa(times, latitude, longitude, how='numpy',
                              delta_t=67.0, numthreads=4):
 
     # Added by Tony Lorenzo (@alorenzo175), University of Arizona, 2015
 
-    lat = latitude
-    lon = longitude
-
     # times must be localized
     if times.tz:
         tzinfo = times.tz
     else:
         raise ValueError('times must be localized')
 
-    # must convert to midnight UTC on day of interest
-    utcday = pd.DatetimeIndex(times.date).tz_localize('UTC')
-    unixtime = np.array(utcday.astype(np.int64)/10**9)
-
-    spa = _spa_python_import(how)
-
-    delta_t = delta_t or spa.calculate_deltat(times.year, times.month)
+    events = sun_rise_set_transit_arrays(times, latitude, longitude, how,
+                                         delta_t, numthreads)
 
-    transit, sunrise, sunset = spa.transit_sunrise_sunset(
-        unixtime, lat, lon, delta_t, numthreads)
-
-    # arrays are in seconds since epoch format, need to conver to timestamps
-    transit = pd.to_datetime(transit*1e9, unit='ns', utc=True).tz_convert(
-        tzinfo).tolist()
-    sunrise = pd.to_datetime(sunrise*1e9, unit='ns', utc=True).tz_convert(
-        tzinfo).tolist()
-    sunset = pd.to_datetime(sunset*1e9, unit='ns', utc=True).tz_convert(
-        tzinfo).tolist()
-
-    return pd.DataFrame(index=times, data={'sunrise': sunrise,
-                                           'sunset': sunset,
-                                           'transit': transit})
+    return pd.DataFrame(index=times, data={
+        key: pd.DatetimeIndex(events[key]).tz_localize('UTC').tz_convert(
+            tzinfo) for key in ('sunrise', 'sunset', 'transit')})
 
 
 # In[13]:
@@ -340,105 +1074,119 @@ def sun_rise_set_transit_ephem(times, latitude, longitude,
 # In[17]:
 
 
-def pyephem(time, latitude, longitude, altitude=0, pressure=101325,
-            temperature=12, horizon='+0:00'):
+# pyephem dates are days since 1899-12-31 12:00 UTC
+_EPHEM_UNIX_EPOCH = 25567.5
 
-    # Written by Will Holmgren (@wholmgren), University of Arizona, 2014
-    try:
-        import ephem
-    except ImportError:
-        raise ImportError('PyEphem must be installed')
+# time ranges are only split across processes in chunks of at least this
+# many timestamps; smaller inputs don't cover the cost of shipping them
+PYEPHEM_MIN_CHUNK = 50000
 
-    # if localized, convert to UTC. otherwise, assume UTC.
-    try:
-        time_utc = time.tz_convert('UTC')
-    except TypeError:
-        time_utc = time
 
-    sun_coords = pd.DataFrame(index=time)
+def _pyephem_positions(djd, latitude, longitude, altitude, pressure,
+                       temperature, horizon):
+    """Apparent and geometric sun alt/az in radians for pyephem dates.
 
+    Returns a (4, n) array of apparent elevation, apparent azimuth,
+    elevation and azimuth.
+    """
     obs, sun = _ephem_setup(latitude, longitude, altitude,
                             pressure, temperature, horizon)
-
-    # make and fill lists of the sun's altitude and azimuth
-    # this is the pressure and temperature corrected apparent alt/az.
-    alts = []
-    azis = []
-    for thetime in time_utc:
-        obs.date = ephem.Date(thetime)
+    pressure = obs.pressure
+    out = np.empty((4, len(djd)))
+    for i, date in enumerate(djd.tolist()):
+        obs.date = date
+        obs.pressure = pressure
         sun.compute(obs)
-        alts.append(sun.alt)
-        azis.append(sun.az)
-
-    sun_coords['apparent_elevation'] = alts
-    sun_coords['apparent_azimuth'] = azis
-
-    # redo it for p=0 to get no atmosphere alt/az
-    obs.pressure = 0
-    alts = []
-    azis = []
-    for thetime in time_utc:
-        obs.date = ephem.Date(thetime)
+        out[0, i] = sun.alt
+        out[1, i] = sun.az
+        # again without atmosphere; pyephem reuses the solar terms for an
+        # unchanged date, so this costs a fraction of the first compute
+        obs.pressure = 0
         sun.compute(obs)
-        alts.append(sun.alt)
-        azis.append(sun.az)
+        out[2, i] = sun.alt
+        out[3, i] = sun.az
+    return out
 
-    sun_coords['elevation'] = alts
-    sun_coords['azimuth'] = azis
 
-    # convert to degrees. add zenith
-    sun_coords = np.rad2deg(sun_coords)
-    sun_coords['apparent_zenith'] = 90 - sun_coords['apparent_elevation']
-    sun_coords['zenith'] = 90 - sun_coords['elevation']
+def pyephem(time, latitude, longitude, altitude=0, pressure=101325,
+            temperature=12, horizon='+0:00', processes=1):
+    """Solar position from PyEphem.
 
-    return sun_coords
+    Apparent (pressure and temperature corrected) and geometric positions
+    come from a single pass over time. With processes > 1 long time
+    ranges are split across a pool of worker processes.
+    """
 
+    # Written by Will Holmgren (@wholmgren), University of Arizona, 2014
+    try:
+        import ephem  # noqa: F401
+    except ImportError:
+        raise ImportError('PyEphem must be installed')
 
-# In[18]:
+    if not isinstance(time, pd.DatetimeIndex):
+        try:
+            time = pd.DatetimeIndex(time)
+        except (TypeError, ValueError):
+            time = pd.DatetimeIndex([time, ])
 
+    # DatetimeIndex.values is UTC when localized; naive times are UTC
+    unixtime = time.values.astype('datetime64[ns]').astype(np.int64)
+    djd = unixtime / 86400e9 + _EPHEM_UNIX_EPOCH
+    args = (latitude, longitude, altitude, pressure, temperature, horizon)
 
-def ephemeris(time, latitude, longitude, pressure=101325, temperature=12):
+    position = _pooled_columns(_pyephem_positions, djd, args, 4, processes,
+                               PYEPHEM_MIN_CHUNK)
+    np.degrees(position, out=position)
+    app_elevation, app_azimuth, elevation, azimuth = position
 
-    Latitude = latitude
-    Longitude = -1 * longitude
+    return pd.DataFrame({'apparent_elevation': app_elevation,
+                         'apparent_azimuth': app_azimuth,
+                         'elevation': elevation, 'azimuth': azimuth,
+                         'apparent_zenith': 90 - app_elevation,
+                         'zenith': 90 - elevation}, index=time)
 
-    Abber = 20 / 3600.
-    LatR = np.radians(Latitude)
 
-    # the SPA algorithm needs time to be expressed in terms of
-    # decimal UTC hours of the day of the year.
+# In[18]:
 
-    # if localized, convert to UTC. otherwise, assume UTC.
-    try:
-        time_utc = time.tz_convert('UTC')
-    except TypeError:
-        time_utc = time
 
-    # strip out the day of the year and calculate the decimal hour
-    DayOfYear = time_utc.dayofyear
-    DecHours = (time_utc.hour + time_utc.minute/60. + time_utc.second/3600. +
-                time_utc.microsecond/3600.e6)
+# the Kepler equation is solved by fixed point iteration, which contracts
+# by the orbital eccentricity (< 0.0168) per step: four steps leave an error
+# below 1e-7 degrees everywhere
+KEPLER_ITERATIONS = 4
+
+EPHEMERIS_COLUMNS = ('apparent_elevation', 'elevation', 'azimuth',
+                     'apparent_zenith', 'zenith', 'solar_time')
+
 
-    # np.array needed for pandas > 0.20
-    UnivDate = np.array(DayOfYear)
-    UnivHr = np.array(DecHours)
+def _ephemeris_time(values):
+    """Years since 1900, day of year and decimal UTC hours as float arrays
+    from UTC datetime64 values"""
+    values = values.astype('datetime64[ns]')
+    years = values.astype('datetime64[Y]')
+    days = values.astype('datetime64[D]')
+    yr = years.astype(np.float64) + 70
+    dayofyear = (days - years).astype(np.float64) + 1
+    hours = (values - days) / np.timedelta64(3600, 's')
+    return yr, dayofyear, hours
 
-    Yr = np.array(time_utc.year) - 1900
-    YrBegin = 365 * Yr + np.floor((Yr - 1) / 4.) - 0.5
 
-    Ezero = YrBegin + UnivDate
+def _ephemeris_numpy(yr, dayofyear, hours, latitude, longitude, pressure,
+                     temperature, out):
+    """Vectorized ephemeris kernel writing the EPHEMERIS_COLUMNS into out"""
+    LatR = np.radians(latitude)
+
+    YrBegin = 365 * yr + np.floor((yr - 1) / 4.) - 0.5
+    Ezero = YrBegin + dayofyear
     T = Ezero / 36525.
 
-    # Calculate Greenwich Mean Sidereal Time (GMST)
+    # Greenwich Mean Sidereal Time and local apparent sidereal time
     GMST0 = 6 / 24. + 38 / 1440. + (
         45.836 + 8640184.542 * T + 0.0929 * T ** 2) / 86400.
     GMST0 = 360 * (GMST0 - np.floor(GMST0))
-    GMSTi = np.mod(GMST0 + 360 * (1.0027379093 * UnivHr / 24.), 360)
-
-    # Local apparent sidereal time
-    LocAST = np.mod((360 + GMSTi - Longitude), 360)
+    GMSTi = np.mod(GMST0 + 360 * (1.0027379093 * hours / 24.), 360)
+    LocAST = np.mod((360 + GMSTi + longitude), 360)
 
-    EpochDate = Ezero + UnivHr / 24.
+    EpochDate = Ezero + hours / 24.
     T1 = EpochDate / 36525.
 
     ObliquityR = np.radians(
@@ -448,68 +1196,181 @@ def ephemeris(time, latitude, longitude, pressure=101325, temperature=12):
     MeanAnom = np.mod((358.47583 + 0.985600267 * EpochDate - 0.00015 *
                        T1 ** 2 - 3e-06 * T1 ** 3), 360)
     Eccen = 0.01675104 - 4.18e-05 * T1 - 1.26e-07 * T1 ** 2
+    EccenDeg = np.degrees(Eccen)
     EccenAnom = MeanAnom
-    E = 0
-
-    while np.max(abs(EccenAnom - E)) > 0.0001:
-        E = EccenAnom
-        EccenAnom = MeanAnom + np.degrees(Eccen)*np.sin(np.radians(E))
+    for _ in range(KEPLER_ITERATIONS):
+        EccenAnom = MeanAnom + EccenDeg * np.sin(np.radians(EccenAnom))
 
     TrueAnom = (
-        2 * np.mod(np.degrees(np.arctan2(((1 + Eccen) / (1 - Eccen)) ** 0.5 *
-                                         np.tan(np.radians(EccenAnom) / 2.), 1)), 360))
-    EcLon = np.mod(MlPerigee + TrueAnom, 360) - Abber
-    EcLonR = np.radians(EcLon)
-    DecR = np.arcsin(np.sin(ObliquityR)*np.sin(EcLonR))
-
-    RtAscen = np.degrees(np.arctan2(np.cos(ObliquityR)*np.sin(EcLonR),
+        2 * np.mod(np.degrees(np.arctan2(
+            ((1 + Eccen) / (1 - Eccen)) ** 0.5 *
+            np.tan(np.radians(EccenAnom) / 2.), 1)), 360))
+    EcLonR = np.radians(np.mod(MlPerigee + TrueAnom, 360) - 20 / 3600.)
+    DecR = np.arcsin(np.sin(ObliquityR) * np.sin(EcLonR))
+    RtAscen = np.degrees(np.arctan2(np.cos(ObliquityR) * np.sin(EcLonR),
                                     np.cos(EcLonR)))
 
     HrAngle = LocAST - RtAscen
     HrAngleR = np.radians(HrAngle)
-    HrAngle = HrAngle - (360 * ((abs(HrAngle) > 180)))
+    HrAngle[abs(HrAngle) > 180] -= 360
 
-    SunAz = np.degrees(np.arctan2(-np.sin(HrAngleR),
-                                  np.cos(LatR)*np.tan(DecR) -
-                                  np.sin(LatR)*np.cos(HrAngleR)))
+    SunAz = out[2]
+    np.degrees(np.arctan2(-np.sin(HrAngleR),
+                          np.cos(LatR) * np.tan(DecR) -
+                          np.sin(LatR) * np.cos(HrAngleR)), out=SunAz)
     SunAz[SunAz < 0] += 360
 
-    SunEl = np.degrees(np.arcsin(
-        np.cos(LatR) * np.cos(DecR) * np.cos(HrAngleR) +
-        np.sin(LatR) * np.sin(DecR)))
-
-    SolarTime = (180 + HrAngle) / 15.
-
-    # Calculate refraction correction
-    Elevation = SunEl
-    TanEl = pd.Series(np.tan(np.radians(Elevation)), index=time_utc)
-    Refract = pd.Series(0, index=time_utc)
-
-    Refract[(Elevation > 5) & (Elevation <= 85)] = (
-        58.1/TanEl - 0.07/(TanEl**3) + 8.6e-05/(TanEl**5))
-
-    Refract[(Elevation > -0.575) & (Elevation <= 5)] = (
-        Elevation *
-        (-518.2 + Elevation*(103.4 + Elevation*(-12.79 + Elevation*0.711))) +
-        1735)
-
-    Refract[(Elevation > -1) & (Elevation <= -0.575)] = -20.774 / TanEl
-
-    Refract *= (283/(273. + temperature)) * (pressure/101325.) / 3600.
-
-    ApparentSunEl = SunEl + Refract
+    SunEl = out[1]
+    np.degrees(np.arcsin(np.cos(LatR) * np.cos(DecR) * np.cos(HrAngleR) +
+                         np.sin(LatR) * np.sin(DecR)), out=SunEl)
+
+    np.divide(180 + HrAngle, 15., out=out[5])
+
+    # refraction correction; each branch is only evaluated on its own
+    # elevations, everything else (night, near zenith) stays zero
+    Refract = out[0]
+    Refract[:] = 0
+    mask = (SunEl > 5) & (SunEl <= 85)
+    TanEl = np.tan(np.radians(SunEl[mask]))
+    Refract[mask] = 58.1 / TanEl - 0.07 / TanEl ** 3 + 8.6e-05 / TanEl ** 5
+    mask = (SunEl > -0.575) & (SunEl <= 5)
+    El = SunEl[mask]
+    Refract[mask] = El * (-518.2 + El * (103.4 + El * (-12.79 + El * 0.711))) \
+        + 1735
+    mask = (SunEl > -1) & (SunEl <= -0.575)
+    Refract[mask] = -20.774 / np.tan(np.radians(SunEl[mask]))
+    Refract *= (283 / (273. + temperature)) * (pressure / 101325.) / 3600.
+
+    Refract += SunEl  # apparent elevation
+    np.subtract(90, out[0], out=out[3])
+    np.subtract(90, SunEl, out=out[4])
+
+
+def _ephemeris_loop(yr, dayofyear, hours, latitude, longitude, pressure,
+                    temperature, out):
+    """Scalar ephemeris kernel, compiled with numba by _ephemeris_kernel"""
+    LatR = math.radians(latitude)
+    sinLat = math.sin(LatR)
+    cosLat = math.cos(LatR)
+    scale = (283 / (273. + temperature)) * (pressure / 101325.) / 3600.
+    for i in range(yr.shape[0]):
+        YrBegin = 365 * yr[i] + math.floor((yr[i] - 1) / 4.) - 0.5
+        Ezero = YrBegin + dayofyear[i]
+        T = Ezero / 36525.
+        GMST0 = 6 / 24. + 38 / 1440. + (
+            45.836 + 8640184.542 * T + 0.0929 * T ** 2) / 86400.
+        GMST0 = 360 * (GMST0 - math.floor(GMST0))
+        GMSTi = (GMST0 + 360 * (1.0027379093 * hours[i] / 24.)) % 360
+        LocAST = (360 + GMSTi + longitude) % 360
+
+        EpochDate = Ezero + hours[i] / 24.
+        T1 = EpochDate / 36525.
+        ObliquityR = math.radians(23.452294 - 0.0130125 * T1 -
+                                  1.64e-06 * T1 ** 2 + 5.03e-07 * T1 ** 3)
+        MlPerigee = (281.22083 + 4.70684e-05 * EpochDate +
+                     0.000453 * T1 ** 2 + 3e-06 * T1 ** 3)
+        MeanAnom = (358.47583 + 0.985600267 * EpochDate -
+                    0.00015 * T1 ** 2 - 3e-06 * T1 ** 3) % 360
+        Eccen = 0.01675104 - 4.18e-05 * T1 - 1.26e-07 * T1 ** 2
+        EccenAnom = MeanAnom
+        for _ in range(KEPLER_ITERATIONS):
+            EccenAnom = MeanAnom + math.degrees(Eccen) * math.sin(
+                math.radians(EccenAnom))
+
+        TrueAnom = 2 * (math.degrees(math.atan2(
+            ((1 + Eccen) / (1 - Eccen)) ** 0.5 *
+            math.tan(math.radians(EccenAnom) / 2.), 1)) % 360)
+        EcLonR = math.radians((MlPerigee + TrueAnom) % 360 - 20 / 3600.)
+        DecR = math.asin(math.sin(ObliquityR) * math.sin(EcLonR))
+        RtAscen = math.degrees(math.atan2(
+            math.cos(ObliquityR) * math.sin(EcLonR), math.cos(EcLonR)))
+
+        HrAngle = LocAST - RtAscen
+        HrAngleR = math.radians(HrAngle)
+        if abs(HrAngle) > 180:
+            HrAngle -= 360
+
+        SunAz = math.degrees(math.atan2(
+            -math.sin(HrAngleR),
+            cosLat * math.tan(DecR) - sinLat * math.cos(HrAngleR)))
+        if SunAz < 0:
+            SunAz += 360
+        SunEl = math.degrees(math.asin(
+            cosLat * math.cos(DecR) * math.cos(HrAngleR) +
+            sinLat * math.sin(DecR)))
+
+        if 5 < SunEl <= 85:
+            TanEl = math.tan(math.radians(SunEl))
+            Refract = 58.1 / TanEl - 0.07 / TanEl ** 3 + 8.6e-05 / TanEl ** 5
+        elif -0.575 < SunEl <= 5:
+            Refract = SunEl * (-518.2 + SunEl * (
+                103.4 + SunEl * (-12.79 + SunEl * 0.711))) + 1735
+        elif -1 < SunEl <= -0.575:
+            Refract = -20.774 / math.tan(math.radians(SunEl))
+        else:
+            Refract = 0.
+        ApparentSunEl = SunEl + Refract * scale
+
+        out[0, i] = ApparentSunEl
+        out[1, i] = SunEl
+        out[2, i] = SunAz
+        out[3, i] = 90 - ApparentSunEl
+        out[4, i] = 90 - SunEl
+        out[5, i] = (180 + HrAngle) / 15.
+
+
+_ephemeris_kernels = {'numpy': _ephemeris_numpy}
+
+
+def _ephemeris_kernel(how):
+    try:
+        return _ephemeris_kernels[how]
+    except KeyError:
+        pass
+    if how != 'numba':
+        raise ValueError("how must be either 'numba' or 'numpy'")
+    try:
+        import numba
+    except ImportError:
+        raise ImportError('numba must be installed')
+    with _spa_lock:
+        if how not in _ephemeris_kernels:
+            _ephemeris_kernels[how] = numba.njit(
+                cache=True, nogil=True)(_ephemeris_loop)
+    return _ephemeris_kernels[how]
+
+
+def ephemeris(time, latitude, longitude, pressure=101325, temperature=12,
+              how='numpy', numthreads=4):
+    """Solar position from the ephemeris algorithm.
+
+    how='numpy' evaluates the whole index with array operations;
+    how='numba' runs a compiled per-timestamp loop, split across
+    numthreads pooled threads for large inputs. Both write into one
+    preallocated output array.
+    """
+    if not isinstance(time, pd.DatetimeIndex):
+        try:
+            time = pd.DatetimeIndex(time)
+        except (TypeError, ValueError):
+            time = pd.DatetimeIndex([time, ])
 
-    # make output DataFrame
-    DFOut = pd.DataFrame(index=time_utc)
-    DFOut['apparent_elevation'] = ApparentSunEl
-    DFOut['elevation'] = SunEl
-    DFOut['azimuth'] = SunAz
-    DFOut['apparent_zenith'] = 90 - ApparentSunEl
-    DFOut['zenith'] = 90 - SunEl
-    DFOut['solar_time'] = SolarTime
-    DFOut.index = time
+    kernel = _ephemeris_kernel(how)
+    # DatetimeIndex.values is UTC for localized indexes
+    yr, dayofyear, hours = _ephemeris_time(time.values)
+    # the kernels take longitude as positive east
+    args = (latitude, longitude, pressure, temperature)
+    out = np.empty((len(EPHEMERIS_COLUMNS), len(time)))
+
+    if how == 'numba':
+        args = tuple(float(arg) for arg in args)
+        _map_chunks(lambda a, b: kernel(yr[a:b], dayofyear[a:b], hours[a:b],
+                                        *args, out[:, a:b]),
+                    len(time), numthreads)
+    else:
+        kernel(yr, dayofyear, hours, *args, out)
 
-    return DFOut
+    return pd.DataFrame(dict(zip(EPHEMERIS_COLUMNS, out)), index=time)
 
 
 # In[19]:
@@ -523,6 +1384,7 @@ def calc_time(lower_bound, upper_bound, latitude, longitude, attribute, value,
         import scipy.optimize as so
     except ImportError:
         raise ImportError('The calc_time function requires scipy')
+    from pvlib.tools import datetime_to_djd, djd_to_datetime
 
     obs, sun = _ephem_setup(latitude, longitude, altitude,
                             pressure, temperature, horizon)
@@ -541,18 +1403,203 @@ def calc_time(lower_bound, upper_bound, latitude, longitude, attribute, value,
     return djd_to_datetime(djd_root)
 
 
-# In[20]:
+def _unix_seconds(times):
+    """Float unix seconds from datetime-like values, keeping their shape;
+    naive values are taken as UTC"""
+    if isinstance(times, pd.DatetimeIndex):
+        values = times.values
+    else:
+        shape = np.shape(times)
+        values = pd.to_datetime(np.ravel(times), utc=True).values.reshape(
+            shape)
+    values = values.astype('datetime64[ns]')
+    return np.where(np.isnat(values), np.nan, values.astype(np.int64) / 1e9)
+
+
+def _solar_attribute(unixtime, latitude, longitude, altitude, pressure,
+                     temperature, attribute, method):
+    """One get_solarposition column (degrees) for 1d arrays of unix times
+    and matching observer values"""
+    if method == 'nrel_numpy':
+        spa = _spa_python_import('numpy')
+        R, v, alpha, delta, eot = _spa_time_terms(spa, unixtime, 67.0)
+        columns = dict(zip(
+            ('apparent_zenith', 'zenith', 'apparent_elevation', 'elevation',
+             'azimuth'),
+            _spa_observer_terms(spa, R, v, alpha, delta, latitude, longitude,
+                                altitude, pressure / 100, temperature,
+                                0.5667)))
+        columns['equation_of_time'] = eot
+    elif method == 'ephemeris':
+        out = np.empty((len(EPHEMERIS_COLUMNS), len(unixtime)))
+        values = (unixtime * 1e9).astype(np.int64).view('datetime64[ns]')
+        _ephemeris_numpy(*_ephemeris_time(values), latitude, longitude,
+                         pressure, temperature, out)
+        columns = dict(zip(EPHEMERIS_COLUMNS, out))
+    else:
+        raise ValueError("method must be either 'nrel_numpy' or 'ephemeris'")
+    try:
+        return columns[attribute]
+    except KeyError:
+        raise ValueError('Invalid attribute {!r} for method {!r}'.format(
+            attribute, method))
+
+
+def calc_time_arrays(lower_bounds, upper_bounds, latitude, longitude,
+                     attribute, value, altitude=0, pressure=101325,
+                     temperature=12, method='nrel_numpy', xtol=1.0,
+                     maxiter=50):
+    """Vectorized calc_time: when a solar position attribute reaches value.
+
+    All arguments from lower_bounds to temperature broadcast against each
+    other, so one call can solve every day of a year at many sites.
+    attribute is a get_solarposition column of method ('nrel_numpy' or
+    'ephemeris') in degrees, and must be continuous and cross value once
+    between each pair of bounds. Roots are found with the Illinois
+    variant of regula falsi, iterating only the elements whose bracket
+    is still wider than xtol seconds and whose last step moved by more
+    than xtol.
+
+    Returns datetime64[ns] UTC values in the broadcast shape; NaT where
+    the bounds do not bracket value.
+    """
+    args = np.broadcast_arrays(
+        _unix_seconds(lower_bounds), _unix_seconds(upper_bounds), latitude,
+        longitude, altitude, pressure, temperature, value)
+    shape = args[0].shape
+    lower, upper, lat, lon, elev, pres, temp, target = [
+        np.ravel(arg).astype(np.float64) for arg in args]
+
+    def f(times, i):
+        return _solar_attribute(times, lat[i], lon[i], elev[i], pres[i],
+                                temp[i], attribute, method) - target[i]
+
+    everything = np.arange(len(lower))
+    flo = f(lower, everything)
+    fhi = f(upper, everything)
+    root = np.full(len(lower), np.nan)
+    root[flo == 0] = lower[flo == 0]
+    root[fhi == 0] = upper[fhi == 0]
+
+    lo = lower.copy()
+    hi = upper.copy()
+    side = np.zeros(len(lower), dtype=np.int8)
+    active = np.flatnonzero(np.sign(flo) * np.sign(fhi) < 0)
+    for _ in range(maxiter):
+        if not len(active):
+            break
+        l, h, fl, fh = lo[active], hi[active], flo[active], fhi[active]
+        c = (l * fh - h * fl) / (fh - fl)
+        fc = f(c, active)
+        step = np.abs(c - root[active])
+        root[active] = c
+
+        # root in [c, h] when f(c) has the sign of f(lo), else in [l, c]
+        right = np.sign(fc) == np.sign(fl)
+        lo[active] = np.where(right, c, l)
+        flo[active] = np.where(right, fc, fl)
+        hi[active] = np.where(right, h, c)
+        fhi[active] = np.where(right, fh, fc)
+        # Illinois: halve the stale end's value when the same end moves
+        # twice in a row, so the interval shrinks from both sides
+        moved = np.where(right, 1, -1).astype(np.int8)
+        repeat = moved == side[active]
+        fhi[active[repeat & right]] /= 2
+        flo[active[repeat & ~right]] /= 2
+        side[active] = moved
+
+        done = (hi[active] - lo[active] <= xtol) | (step <= xtol) | \
+            (fc == 0)
+        active = active[~done]
+
+    return _unix_to_datetime64(root).reshape(shape)
+
+
+# half width of the bracket around the analytical crossing estimate; the
+# few crossings it misses are solved again over the whole half day
+CROSSING_WINDOW = np.timedelta64(10, 'm')
+
+
+def elevation_crossings(days, latitude, longitude, value,
+                        attribute='apparent_elevation', altitude=0,
+                        pressure=101325, temperature=12,
+                        method='nrel_numpy', xtol=1.0):
+    """Morning and evening times the sun crosses value on each day.
+
+    attribute is an elevation or zenith column. Each crossing is first
+    solved within CROSSING_WINDOW of an estimate from the analytical
+    declination and hour angle, then, where that misses, over the twelve
+    hours before or after solar transit. Returns a dict of datetime64[ns]
+    UTC arrays, rising and setting, shaped like sun_rise_set_transit_arrays
+    output; NaT when the sun does not reach value that day.
+    """
+    transit = sun_rise_set_transit_arrays(days, latitude, longitude)[
+        'transit']
+
+    def per_site(value):
+        # site values go down the rows of the (n_sites, n_days) transits
+        if transit.ndim == 2 and np.ndim(value):
+            return np.reshape(value, (-1, 1))
+        return value
+
+    lat, lon, elev, pres, temp = np.broadcast_arrays(
+        *[per_site(arg) for arg in (latitude, longitude, altitude, pressure,
+                                    temperature)], transit.astype(float))[:5]
+
+    elevation = value if 'elevation' in attribute else 90 - value
+    declination = declination_spencer71(
+        pd.DatetimeIndex(np.ravel(transit)).dayofyear.values).reshape(
+            transit.shape)
+    lat_rad = np.radians(lat)
+    cos_hour = ((np.sin(np.radians(elevation)) -
+                 np.sin(lat_rad) * np.sin(declination)) /
+                (np.cos(lat_rad) * np.cos(declination)))
+    hours = np.degrees(np.arccos(np.clip(cos_hour, -1, 1))) / 15
+    offset = (hours * 3600e9).astype('timedelta64[ns]')
+
+    half_day = np.timedelta64(12, 'h')
+    out = {}
+    for event, start, stop in (('rising', transit - half_day, transit),
+                               ('setting', transit, transit + half_day)):
+        estimate = transit - offset if event == 'rising' else transit + offset
+        crossing = calc_time_arrays(
+            np.clip(estimate - CROSSING_WINDOW, start, stop),
+            np.clip(estimate + CROSSING_WINDOW, start, stop),
+            lat, lon, attribute, value, elev, pres, temp, method, xtol)
+        missed = np.isnat(crossing)
+        if missed.any():
+            crossing[missed] = calc_time_arrays(
+                start[missed], stop[missed], lat[missed], lon[missed],
+                attribute, value, elev[missed], pres[missed], temp[missed],
+                method, xtol)
+        out[event] = crossing
+    return out
 
 
-def pyephem_earthsun_distance(time):
+# In[20]:
 
+
+def _pyephem_earth_distance(djd):
+    """Earth-sun distance in AU at pyephem dates"""
     import ephem
 
     sun = ephem.Sun()
-    earthsun = []
-    for thetime in time:
-        sun.compute(ephem.Date(thetime))
-        earthsun.append(sun.earth_distance)
+    out = np.empty(len(djd))
+    for i, date in enumerate(djd.tolist()):
+        sun.compute(date)
+        out[i] = sun.earth_distance
+    return out
+
+
+def pyephem_earthsun_distance(time):
+
+    if not isinstance(time, pd.DatetimeIndex):
+        time = pd.DatetimeIndex(time)
+
+    # float pyephem dates straight from the UTC epoch nanoseconds, instead
+    # of an ephem.Date built from each Timestamp's wall clock fields
+    unixtime = time.values.astype('datetime64[ns]').astype(np.int64)
+    earthsun = _pyephem_earth_distance(unixtime / 86400e9 + _EPHEM_UNIX_EPOCH)
 
     return pd.Series(earthsun, index=time)
 
@@ -581,6 +1628,120 @@ def nrel_earthsun_distance(time, how='numpy', delta_t=67.0, numthreads=4):
     return dist
 
 
+# W/m^2 at one AU, as in pvlib.irradiance.get_extra_radiation
+SOLAR_CONSTANT = 1366.1
+
+# rows per DataFrame from earthsun_chunks, about 12 MB each
+EARTHSUN_CHUNK = 500000
+
+EARTHSUN_METHODS = ('nrel_numpy', 'nrel_numba', 'pyephem')
+
+
+class EarthSunDistanceTable:
+    """Earth-sun distance at UTC midnights, linearly interpolated between.
+
+    The distance moves by under 3e-4 AU a day and bends slowly enough
+    that interpolating daily values stays within 1e-6 AU of computing
+    every timestamp. Days are computed the first time they are needed and
+    kept; a century is under 300 kB.
+    """
+
+    def __init__(self, method='nrel_numpy', delta_t=67.0):
+        if method not in EARTHSUN_METHODS:
+            raise ValueError('Invalid earth-sun distance method')
+        self.method = method
+        self.delta_t = delta_t
+        # distance at the midnight starting day self._first, and each
+        # following day
+        self._first = None
+        self._distance = np.empty(0)
+        self._lock = threading.Lock()
+
+    def _compute(self, first, last):
+        """Distances at the midnights of days first to last since the epoch"""
+        days = np.arange(first, last + 1)
+        if self.method == 'pyephem':
+            return _pyephem_earth_distance(days + _EPHEM_UNIX_EPOCH)
+        spa = _spa_python_import(
+            'numba' if self.method == 'nrel_numba' else 'numpy')
+        midnights = pd.DatetimeIndex(days.astype('datetime64[D]'))
+        delta_t = self.delta_t or spa.calculate_deltat(midnights.year,
+                                                       midnights.month)
+        return spa.earthsun_distance(days * 86400., delta_t, 1)
+
+    def _nodes(self, first, last):
+        with self._lock:
+            if self._first is None:
+                self._distance = self._compute(first, last)
+                self._first = first
+            if first < self._first:
+                self._distance = np.concatenate(
+                    [self._compute(first, self._first - 1), self._distance])
+                self._first = first
+            end = self._first + len(self._distance) - 1
+            if last > end:
+                self._distance = np.concatenate(
+                    [self._distance, self._compute(end + 1, last)])
+            start = first - self._first
+            return self._distance[start:start + last - first + 1]
+
+    def distance(self, unixtime):
+        """Earth-sun distance in AU at epoch seconds unixtime"""
+        days = np.asarray(unixtime, dtype=np.float64) / 86400
+        if not np.isfinite(days).any():
+            return np.full(days.shape, np.nan)
+        first = int(np.floor(np.nanmin(days)))
+        last = int(np.floor(np.nanmax(days))) + 1
+        nodes = self._nodes(first, last)
+        return np.interp(days, np.arange(first, last + 1), nodes)
+
+
+_earthsun_tables = {}
+
+
+def earthsun_table(method='nrel_numpy'):
+    """Shared EarthSunDistanceTable for method, with the default delta_t"""
+    with _spa_lock:
+        table = _earthsun_tables.get(method)
+        if table is None:
+            table = _earthsun_tables[method] = EarthSunDistanceTable(method)
+    return table
+
+
+def extraterrestrial_irradiance(distance, solar_constant=SOLAR_CONSTANT):
+    """Irradiance normal to the sun's rays at the top of the atmosphere,
+    W/m^2, at an earth-sun distance in AU"""
+    return solar_constant / np.square(distance)
+
+
+def earthsun_chunks(start, end, freq='1min', tz=None, method='nrel_numpy',
+                    chunk=EARTHSUN_CHUNK, solar_constant=SOLAR_CONSTANT):
+    """Earth-sun distance and extraterrestrial irradiance every freq from
+    start to end inclusive, as DataFrames of up to chunk rows.
+
+    Timestamps are generated a chunk at a time, so memory stays bounded
+    however long the range. freq must be a fixed step such as '1min' or
+    '1h'.
+    """
+    table = earthsun_table(method)
+    start = pd.Timestamp(start, tz=tz)
+    end = pd.Timestamp(end, tz=tz)
+    step = pd.tseries.frequencies.to_offset(freq).nanos
+    count = max((end.value - start.value) // step + 1, 0)
+    for offset in range(0, count, chunk):
+        ns = start.value + step * np.arange(
+            offset, min(offset + chunk, count), dtype=np.int64)
+        time = pd.DatetimeIndex(ns.view('datetime64[ns]'))
+        if start.tz is not None:
+            time = time.tz_localize('UTC').tz_convert(start.tz)
+        distance = table.distance(ns / 1e9)
+        yield pd.DataFrame(
+            {'earthsun_distance': distance,
+             'dni_extra': extraterrestrial_irradiance(distance,
+                                                      solar_constant)},
+            index=time)
+
+
 def _calculate_simple_day_angle(dayofyear, offset=1):
 
     return (2. * np.pi / 365.) * (dayofyear - offset)
@@ -757,6 +1918,64 @@ def sun_rise_set_transit_geometric(times, latitude, longitude, declination,
     return sunrise, sunset, transit
 
 
+# epoch and offset of the day number fed to the Spencer (1971) fits; the
+# offset minimizes the zenith error against spa_python over 2019-2026
+_TROPICAL_EPOCH = np.datetime64('2000-01-01T00:00', 'ns')
+_TROPICAL_YEAR = 365.2422
+_TROPICAL_OFFSET = 0.7
+
+
+def _tropical_dayofyear(values):
+    """Fractional day number in a tropical year counted from 2000, so the
+    seasons of the Spencer fits don't drift through the leap year cycle as
+    they do with the calendar day of year"""
+    days = (values.astype('datetime64[ns]') - _TROPICAL_EPOCH) / \
+        np.timedelta64(86400, 's')
+    return days % _TROPICAL_YEAR + _TROPICAL_OFFSET
+
+
+def analytical(time, latitude, longitude, pressure=101325, temperature=12,
+               atmos_refract=None, **kwargs):
+    """Low cost solar position from the analytical helpers above.
+
+    Chains declination_spencer71, equation_of_time_spencer71, hour_angle,
+    solar_zenith_analytical and solar_azimuth_analytical, evaluated at a
+    tropical year day number (_tropical_dayofyear); apparent angles add
+    the SPA refraction correction. Against spa_python over 2019-2026 at
+    latitudes -60 to 80 the differences stay below 0.16 degrees in zenith
+    while the sun is up and 0.65 minutes in the equation of time. Azimuth
+    is within 0.75 degrees for zenith angles between 10 and 170 degrees.
+    It is poorly conditioned near the zenith and the nadir: beyond 170
+    degrees errors of tens of degrees (up to 61) have been measured.
+    """
+    if not isinstance(time, pd.DatetimeIndex):
+        try:
+            time = pd.DatetimeIndex(time)
+        except (TypeError, ValueError):
+            time = pd.DatetimeIndex([time, ])
+
+    dayofyear = _tropical_dayofyear(time.values)
+    eot = equation_of_time_spencer71(dayofyear)
+    declination = declination_spencer71(dayofyear)
+    hourangle = np.radians(
+        (hour_angle(time, longitude, eot) + 180) % 360 - 180)
+    lat = np.radians(latitude)
+    zenith = solar_zenith_analytical(lat, hourangle, declination)
+    azimuth = np.degrees(
+        solar_azimuth_analytical(lat, hourangle, declination, zenith))
+    elevation = 90 - np.degrees(zenith)
+
+    spa = _spa_python_import('numpy')
+    app_elevation = elevation + spa.atmospheric_refraction_correction(
+        pressure / 100, temperature, elevation, atmos_refract or 0.5667)
+
+    return pd.DataFrame({'apparent_zenith': 90 - app_elevation,
+                         'zenith': 90 - elevation,
+                         'apparent_elevation': app_elevation,
+                         'elevation': elevation, 'azimuth': azimuth,
+                         'equation_of_time': eot}, index=time)
+
+
 # In[33]:
 
 
@@ -787,3 +2006,21 @@ def sun_rise_set_transit_geometric(times, latitude, longitude, declination,
 
 # for k, v in d.items():
 #     print(k, '=', v)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Build the ephemeris table used by method='table'")
+    parser.add_argument('path', nargs='?', default='ephemeris_table.npy')
+    parser.add_argument('--start-year', type=int,
+                        default=dt.date.today().year - 1)
+    parser.add_argument('--end-year', type=int,
+                        default=dt.date.today().year + 1)
+    parser.add_argument('--step', type=float, default=60,
+                        help='seconds between rows')
+    parser.add_argument('--delta-t', type=float, default=67.0)
+    args = parser.parse_args()
+    build_ephemeris_table(args.path, args.start_year, args.end_year,
+                          args.step, args.delta_t)